@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-condition read counts and enrichments for the yeast display NGS data.
+
+Replaces the chained outer merges of ``func1``/``func2`` in
+``analyse_NGS_3hb_NGS.ipynb``: every protein sequence is interned to an
+integer id and each sorting condition only adds a sparse column of
+``(id, count)`` pairs, so adding a sort costs as much as its own number of
+distinct sequences. With the notebook's ``input_`` and ``enrich_``::
+
+    df = enrichment_table(input_, enrich_, ['KNY', 'KE'])
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    from . import fastq
+except ImportError:
+    import fastq
+
+
+class CountMatrix(object):
+    """Sparse (sequence x condition) count matrix in coordinate form.
+    """
+    def __init__(self):
+        self.index = {}  # Sequence -> row id
+        self.conditions = []
+        self._rows = []
+        self._counts = []
+
+    @property
+    def seqs(self):
+        return list(self.index)
+
+    @property
+    def shape(self):
+        return len(self.index), len(self.conditions)
+
+    def add(self, condition, counts):
+        """Add the column of a condition.
+
+        :param str condition: Column name (e.g. ``D25_100pM``).
+        :param counts: Mapping of sequence to count (e.g. the
+            :class:`~collections.Counter` of :func:`.fastq.count_fastq`).
+        """
+        if condition in self.conditions:
+            raise ValueError('condition {} already added'.format(condition))
+        index = self.index
+        rows = np.fromiter((index.setdefault(s, len(index)) for s in counts),
+                           dtype=np.int64, count=len(counts))
+        self.conditions.append(condition)
+        self._rows.append(rows)
+        self._counts.append(np.fromiter(counts.values(), dtype=np.int64,
+                                        count=len(counts)))
+
+    def column(self, condition):
+        """Dense counts of a condition, zero for unseen sequences.
+        """
+        i = self.conditions.index(condition)
+        return np.bincount(self._rows[i], weights=self._counts[i],
+                           minlength=len(self.index)).astype(np.int64)
+
+    def coo(self):
+        """Row ids, column ids and counts of all non-zero entries.
+        """
+        cols = [np.full(len(r), i, dtype=np.int64)
+                for i, r in enumerate(self._rows)]
+        if len(cols) == 0:
+            return (np.zeros(0, dtype=np.int64), ) * 3
+        return (np.concatenate(self._rows), np.concatenate(cols),
+                np.concatenate(self._counts))
+
+    def to_frame(self):
+        """Dense DataFrame with a ``seq`` column and one per condition.
+        """
+        data = {'seq': self.seqs}
+        for c in self.conditions:
+            data[c] = self.column(c)
+        return pd.DataFrame(data, columns=['seq'] + self.conditions)
+
+
+def count_conditions(input_, matches, processes=None, cache=False,
+                     matrix=None):
+    """Count the proteins of every condition into a :class:`CountMatrix`.
+
+    :param dict input_: ``{binder: {condition: fastq_file}}``; columns are
+        named ``<binder>_<condition>``.
+    :param list matches: Anchor regexes (see :func:`.fastq.translate_3frames`).
+    :param matrix: Existing :class:`CountMatrix` to add the conditions to.
+    """
+    matrix = CountMatrix() if matrix is None else matrix
+    for binder in input_:
+        for cond in input_[binder]:
+            matrix.add('{}_{}'.format(binder, cond),
+                       fastq.count_fastq(input_[binder][cond], matches,
+                                         processes, cache=cache))
+    return matrix
+
+
+def enrichment(matrix, enrich, pseudocount=1):
+    """Sequence counts and enrichments of each binder.
+
+    For each ``binder: [high, low]`` in ``enrich``, ``enrichment_<binder>``
+    is the ratio of counts under high and low selective pressure, as in the
+    notebook (``inf`` or ``NaN`` when there are no reads under low
+    pressure), and ``log2_enrichment_<binder>`` is
+    ``log2((high + pseudocount) / (low + pseudocount))``, which is always
+    finite.
+
+    :param matrix: :class:`CountMatrix` with ``<binder>_<condition>``
+        columns.
+    :param dict enrich: ``{binder: [high, low]}`` conditions.
+    """
+    df = matrix.to_frame()
+    df['len'] = df['seq'].str.len()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for binder in enrich:
+            high = df['{}_{}'.format(binder, enrich[binder][0])].values
+            low = df['{}_{}'.format(binder, enrich[binder][1])].values
+            df['enrichment_{}'.format(binder)] = high / low.astype(float)
+            df['log2_enrichment_{}'.format(binder)] = (
+                np.log2(high + pseudocount) - np.log2(low + pseudocount))
+    return df
+
+
+def enrichment_table(input_, enrich, matches, pseudocount=1,
+                     processes=None, cache=False):
+    """Counts and enrichments of all conditions (the notebook's ``func1``).
+    """
+    matrix = count_conditions(input_, matches, processes, cache)
+    return enrichment(matrix, enrich, pseudocount)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming FASTQ to protein-count pipeline for the yeast display NGS data.
+
+Reproduces ``read_count_fastq`` from ``analyse_NGS_3hb_NGS.ipynb``: each
+read is translated in its three forward frames, the first frame in which
+all anchor motifs are found is kept (an empty sequence if there is none)
+and the protein is trimmed to what lies between the first ``AS`` and the
+last ``GS``. Identical reads are counted first and only distinct ones are
+translated, in chunks spread over a process pool, with translation done
+over NumPy arrays for the whole chunk at once.
+
+Time spent counting and translating is logged at ``DEBUG`` level.
+"""
+import functools
+import gzip
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import Counter, deque
+
+import numpy as np
+import pandas as pd
+
+CODON_TABLE = {
+    'ATA': 'I', 'ATC': 'I', 'ATT': 'I', 'ATG': 'M',
+    'ACA': 'T', 'ACC': 'T', 'ACG': 'T', 'ACT': 'T',
+    'AAC': 'N', 'AAT': 'N', 'AAA': 'K', 'AAG': 'K',
+    'AGC': 'S', 'AGT': 'S', 'AGA': 'R', 'AGG': 'R',
+    'CTA': 'L', 'CTC': 'L', 'CTG': 'L', 'CTT': 'L',
+    'CCA': 'P', 'CCC': 'P', 'CCG': 'P', 'CCT': 'P',
+    'CAC': 'H', 'CAT': 'H', 'CAA': 'Q', 'CAG': 'Q',
+    'CGA': 'R', 'CGC': 'R', 'CGG': 'R', 'CGT': 'R',
+    'GTA': 'V', 'GTC': 'V', 'GTG': 'V', 'GTT': 'V',
+    'GCA': 'A', 'GCC': 'A', 'GCG': 'A', 'GCT': 'A',
+    'GAC': 'D', 'GAT': 'D', 'GAA': 'E', 'GAG': 'E',
+    'GGA': 'G', 'GGC': 'G', 'GGG': 'G', 'GGT': 'G',
+    'TCA': 'S', 'TCC': 'S', 'TCG': 'S', 'TCT': 'S',
+    'TTC': 'F', 'TTT': 'F', 'TTA': 'L', 'TTG': 'L',
+    'TAC': 'Y', 'TAT': 'Y', 'TAA': '_', 'TAG': '_',
+    'TGC': 'C', 'TGT': 'C', 'TGA': '_', 'TGG': 'W', }
+
+# Nucleotides as base-5 digits (anything but ACGT is 4), and the amino
+# acid of each base-5 codon index; codons with an unknown base are 'X'.
+_BASES = 'ACGT'
+_NT = np.full(256, 4, dtype=np.int64)
+for _i, _b in enumerate(_BASES):
+    _NT[ord(_b)] = _i
+_AA = np.full(125, ord('X'), dtype=np.uint8)
+for _codon, _aa in CODON_TABLE.items():
+    _AA[sum(_BASES.index(b) * 5 ** (2 - i)
+            for i, b in enumerate(_codon))] = ord(_aa)
+_SEP = ord('\n')
+
+_log = logging.getLogger(__name__)
+
+
+def read_fastq(filename, chunksize=100000):
+    """Stream the sequences of a (gzipped) FASTQ file in chunks.
+
+    :param str filename: FASTQ file.
+    :param int chunksize: Reads per chunk.
+
+    :return: Iterator of lists of sequences, without trailing ``>``.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    chunk = []
+    with opener(filename, 'rt') as fd:
+        for i, line in enumerate(fd):
+            if i % 4 == 1:
+                chunk.append(line.rstrip().rstrip('>'))
+                if len(chunk) == chunksize:
+                    yield chunk
+                    chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def translate_frame(seqs, frame=0):
+    """Translate all sequences in a given forward frame.
+
+    Incomplete trailing codons are dropped and codons with unknown bases
+    become ``X``, as in the notebook's ``translate_dna_sequence``.
+
+    :return: All proteins joined by newlines (:class:`str`) and the
+        start and length of each protein in it.
+    """
+    lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+    starts = np.cumsum(lengths) - lengths
+    codes = _NT[np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)]
+
+    counts = np.maximum(lengths - frame, 0) // 3
+    offsets = np.cumsum(counts) - counts
+    codon = np.arange(counts.sum())
+    pos = np.repeat(starts + frame - 3 * offsets, counts) + 3 * codon
+    if len(pos) > 0:
+        aa = _AA[codes[pos] * 25 + codes[pos + 1] * 5 + codes[pos + 2]]
+    else:
+        aa = np.zeros(0, dtype=np.uint8)
+
+    # Separate proteins with a newline, so regexes cannot span two reads.
+    offsets = offsets + np.arange(len(seqs))
+    joined = np.full(len(aa) + len(seqs), _SEP, dtype=np.uint8)
+    joined[codon + np.repeat(np.arange(len(seqs)), counts)] = aa
+    return joined.tobytes().decode('ascii'), offsets, counts
+
+
+def has_motif(joined, offsets, pattern):
+    """Which of the joined proteins contain a regex ``pattern``.
+    """
+    found = np.zeros(len(offsets), dtype=bool)
+    starts = [m.start() for m in re.finditer(pattern, joined)]
+    if len(starts) > 0:
+        found[np.searchsorted(offsets, starts, side='right') - 1] = True
+    return found
+
+
+def translate_3frames(seqs, matches):
+    """Translate each sequence in the first frame containing all anchors.
+
+    :param list seqs: DNA sequences.
+    :param list matches: Anchor regexes (e.g. ``['KNY', 'KE']``).
+
+    :return: List of proteins (empty for reads without a valid frame).
+    """
+    proteins = [''] * len(seqs)
+    pending = np.ones(len(seqs), dtype=bool)
+    for frame in range(3):
+        joined, offsets, counts = translate_frame(seqs, frame)
+        ok = pending.copy()
+        for m in matches:
+            ok &= has_motif(joined, offsets, m)
+        for i in np.flatnonzero(ok).tolist():
+            proteins[i] = joined[offsets[i]:offsets[i] + counts[i]]
+        pending &= ~ok
+    return proteins
+
+
+def adapt_length(proteins):
+    """Keep what lies between the first ``AS`` and the last ``GS``.
+
+    Equivalent to ``re.search('AS(.*)GS', seq).group(1)``; proteins
+    without such a match are kept as they are.
+    """
+    trimmed = []
+    for p in proteins:
+        ini, end = p.find('AS'), p.rfind('GS')
+        trimmed.append(p[ini + 2:end] if ini >= 0 and end >= ini + 2 else p)
+    return trimmed
+
+
+def count_chunk(seqs, matches, counts=None):
+    """Count the trimmed proteins of a chunk of reads.
+
+    :param list seqs: DNA sequences.
+    :param list matches: Anchor regexes.
+    :param list counts: Number of reads for each sequence (default: one).
+    """
+    proteins = adapt_length(translate_3frames(seqs, matches))
+    if counts is None:
+        return Counter(proteins)
+    total = Counter()
+    for p, n in zip(proteins, counts):
+        total[p] += n
+    return total
+
+
+def _cache_file(filename):
+    return filename + '.counts.npz'
+
+
+def _stamp(filename):
+    st = os.stat(filename)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def _write_counts(filename, reads):
+    """Store the read counts of a FASTQ file in ``<filename>.counts.npz``.
+    """
+    seqs = '\n'.join(reads.keys()).encode('ascii')
+    tmp = _cache_file(filename) + '.tmp.npz'
+    np.savez(tmp, stamp=_stamp(filename),
+             seqs=np.frombuffer(seqs, dtype=np.uint8),
+             counts=np.fromiter(reads.values(), dtype=np.int64,
+                                count=len(reads)))
+    os.replace(tmp, _cache_file(filename))
+
+
+def _read_counts(filename):
+    """Load the read counts of a FASTQ file, if cached and up to date.
+    """
+    if not os.path.isfile(_cache_file(filename)):
+        return None
+    with np.load(_cache_file(filename)) as data:
+        if not np.array_equal(data['stamp'], _stamp(filename)):
+            return None
+        counts = data['counts'].tolist()
+        if len(counts) == 0:
+            return Counter()
+        seqs = data['seqs'].tobytes().decode('ascii').split('\n')
+    return Counter(dict(zip(seqs, counts)))
+
+
+def count_reads(filename, chunksize=100000, cache=False):
+    """Count identical DNA reads of a FASTQ file.
+
+    With ``cache``, counts are stored next to the FASTQ file and re-used
+    while it does not change.
+
+    :return: :class:`~collections.Counter` of DNA sequences.
+    """
+    start = time.perf_counter()
+    reads = _read_counts(filename) if cache else None
+    if reads is not None:
+        _log.debug('count_reads %s: %d distinct cached reads in %.3f s',
+                   filename, len(reads), time.perf_counter() - start)
+        return reads
+    reads = Counter()
+    for chunk in read_fastq(filename, chunksize):
+        reads.update(chunk)
+    _log.debug('count_reads %s: %d reads (%d distinct) in %.3f s', filename,
+               sum(reads.values()), len(reads), time.perf_counter() - start)
+    if cache:
+        _write_counts(filename, reads)
+    return reads
+
+
+def count_proteins(reads, matches, processes=None, chunksize=100000):
+    """Count the trimmed proteins of already counted DNA reads.
+
+    Only distinct reads are translated, so analysing the same reads with
+    other anchors does not need to go through the FASTQ file again.
+    Chunks of distinct reads are processed in a pool of ``processes``
+    workers, with at most two chunks per worker in flight.
+
+    :param reads: :class:`~collections.Counter` of DNA sequences.
+    :return: :class:`~collections.Counter` of protein sequences.
+    """
+    start = time.perf_counter()
+    seqs, counts = list(reads.keys()), list(reads.values())
+    chunks = [(seqs[i:i + chunksize], counts[i:i + chunksize])
+              for i in range(0, len(seqs), chunksize)]
+    if len(chunks) <= 1:
+        total = count_chunk(seqs, matches, counts)
+        _log.debug('count_proteins: %d distinct reads in %.3f s', len(seqs),
+                   time.perf_counter() - start)
+        return total
+
+    total = Counter()
+    work = functools.partial(count_chunk, matches=matches)
+    window = 2 * (processes or os.cpu_count())
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        for chunk, n in chunks:
+            pending.append(pool.apply_async(work, (chunk, ), {'counts': n}))
+            if len(pending) >= window:
+                total.update(pending.popleft().get())
+        while len(pending) > 0:
+            total.update(pending.popleft().get())
+    finally:
+        pool.close()
+        pool.join()
+    _log.debug('count_proteins: %d distinct reads in %d chunks in %.3f s',
+               len(seqs), len(chunks), time.perf_counter() - start)
+    return total
+
+
+def count_fastq(filename, matches, processes=None, chunksize=100000,
+                cache=False):
+    """Count the trimmed proteins of a FASTQ file.
+
+    Identical reads are counted first (see :func:`count_reads`) and only
+    distinct ones are translated (see :func:`count_proteins`).
+
+    :return: :class:`~collections.Counter` of protein sequences.
+    """
+    return count_proteins(count_reads(filename, chunksize, cache), matches,
+                          processes, chunksize)
+
+
+def read_count_fastq(jobid, filename, matches, processes=None,
+                     chunksize=100000, cache=False):
+    """Protein counts of a FASTQ file as a DataFrame.
+
+    Same output as the notebook's ``read_count_fastq``: columns ``seq``
+    and ``jobid``, sorted by decreasing count.
+    """
+    counts = count_fastq(filename, matches, processes, chunksize, cache)
+    df = pd.DataFrame({'seq': list(counts.keys()),
+                       jobid: list(counts.values())})
+    return df.sort_values(jobid, ascending=False).reset_index(drop=True)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Assignment of NGS reads to the designs of an oligo library
+(e.g. ``4b1a_oligos.fasta``), tolerating sequencing errors.
+
+What gets assigned is the region the library varies: the trimmed
+proteins counted by :func:`.fastq.count_fastq` (translated in the first
+frame with all anchors and cut between the first ``AS`` and the last
+``GS``). Raw reads still carry their flanks and are not assigned as they
+are. DNA designs are translated and trimmed the same way when the anchors
+are given to :meth:`OligoIndex.from_fasta`::
+
+    index = OligoIndex.from_fasta('4b1a_oligos.fasta', max_dist=2,
+                                  matches=['KNY', 'KE'])
+    counts = index.assign(fastq.count_fastq('101F_high.fastq',
+                                            ['KNY', 'KE']))
+
+The index splits each design into ``max_dist + 1`` segments. By the
+pigeonhole principle, a sequence within ``max_dist`` substitutions (or
+edits, with ``indels``) of a design contains at least one of its segments
+unchanged, at the same position (shifted by at most ``max_dist`` with
+``indels``). Segments are looked up in hash tables to get a few candidate
+designs per distinct sequence, and all (sequence, candidate) pairs are
+then verified at once over NumPy arrays. Sequences identical to a design
+skip all of this.
+"""
+from collections import Counter
+
+import numpy as np
+
+try:
+    from . import fastq
+except ImportError:
+    import fastq
+
+# (sequence, candidate) pairs verified per NumPy batch.
+BATCH = 65536
+
+
+def read_fasta(filename):
+    """Read the ``(name, sequence)`` pairs of a FASTA file.
+
+    Lines starting with ``#`` are ignored.
+    """
+    records, name, seq = [], None, []
+    with open(filename) as fd:
+        for line in fd:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            if line.startswith('>'):
+                if name is not None:
+                    records.append((name, ''.join(seq)))
+                name, seq = line[1:].split()[0], []
+            else:
+                seq.append(line)
+    if name is not None:
+        records.append((name, ''.join(seq)))
+    return records
+
+
+def _segments(length, n):
+    """Start and length of ``n`` near-equal segments of a sequence.
+    """
+    bounds = [length * i // n for i in range(n + 1)]
+    return [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(n)]
+
+
+def edit_distance(a, b, bound):
+    """Levenshtein distance of two sequences, or ``bound + 1`` if larger.
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (ca != cb))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+
+def _as_array(seqs):
+    """Sequences of the same length as rows of a :class:`numpy.uint8` array.
+    """
+    n = len(seqs[0]) if len(seqs) > 0 else 0
+    return np.frombuffer(''.join(seqs).encode('ascii'),
+                         dtype=np.uint8).reshape(len(seqs), n)
+
+
+def hamming_distances(a, b):
+    """Hamming distance of each row of ``a`` to the same row of ``b``.
+    """
+    return np.count_nonzero(a != b, axis=1)
+
+
+def edit_distances(a, b, bound):
+    """Levenshtein distance of each row of ``a`` to the same row of ``b``
+    (capped at ``bound + 1``).
+
+    Rows are processed together, one row of the dynamic programming matrix
+    at a time: substitutions and deletions are vectorised and insertions
+    are a running minimum along the row.
+    """
+    npairs, nb = b.shape
+    j = np.arange(nb + 1)
+    previous = np.broadcast_to(j, (npairs, nb + 1))
+    for i in range(a.shape[1]):
+        cost = (b != a[:, i:i + 1]).astype(np.int64)
+        current = np.empty((npairs, nb + 1), dtype=np.int64)
+        current[:, 0] = i + 1
+        current[:, 1:] = np.minimum(previous[:, 1:] + 1,
+                                    previous[:, :-1] + cost)
+        previous = np.minimum.accumulate(current - j, axis=1) + j
+    return np.minimum(previous[:, -1], bound + 1)
+
+
+class OligoIndex(object):
+    """Seed index over the designs of an oligo library.
+
+    Designs with identical sequences are merged under the first name.
+
+    :param designs: List of ``(name, sequence)`` pairs.
+    :param int max_dist: Maximum number of errors of an assigned sequence.
+    :param bool indels: Allow insertions and deletions (edit distance)
+        instead of substitutions only (Hamming distance).
+    """
+    def __init__(self, designs, max_dist=2, indels=False):
+        self.names, self.seqs, self.exact = [], [], {}
+        for name, seq in designs:
+            if seq not in self.exact:
+                self.exact[seq] = len(self.seqs)
+                self.names.append(name)
+                self.seqs.append(seq)
+        self.max_dist = max_dist
+        self.indels = indels
+
+        # Per design length, one table per segment mapping the segment
+        # sequence to the designs that have it.
+        self.tables = {}
+        for i, s in enumerate(self.seqs):
+            segments = self.tables.setdefault(len(s), {})
+            for ini, size in _segments(len(s), max_dist + 1):
+                table = segments.setdefault((ini, size), {})
+                table.setdefault(s[ini:ini + size], []).append(i)
+
+    @classmethod
+    def from_fasta(cls, filename, max_dist=2, indels=False, matches=None):
+        """Index the designs of a FASTA file.
+
+        :param list matches: Anchor regexes. If given, designs are DNA and
+            are translated and trimmed like the reads counted by
+            :func:`.fastq.count_fastq`; designs without a frame containing
+            all anchors are skipped.
+        """
+        designs = read_fasta(filename)
+        if matches is not None:
+            proteins = fastq.adapt_length(fastq.translate_3frames(
+                [d[1] for d in designs], matches))
+            designs = [(d[0], p) for d, p in zip(designs, proteins)
+                       if len(p) > 0]
+        return cls(designs, max_dist, indels)
+
+    def candidates(self, seq):
+        """Designs sharing at least one seed with a sequence.
+        """
+        found = set()
+        shifts = range(-self.max_dist, self.max_dist + 1) if self.indels \
+            else [0]
+        lengths = range(len(seq) - self.max_dist,
+                        len(seq) + self.max_dist + 1) if self.indels \
+            else [len(seq)]
+        for length in lengths:
+            for (ini, size), table in self.tables.get(length, {}).items():
+                for shift in shifts:
+                    if ini + shift < 0 or ini + shift + size > len(seq):
+                        continue
+                    found.update(table.get(
+                        seq[ini + shift:ini + shift + size], ()))
+        return sorted(found)
+
+    def distances(self, seqs, query, design):
+        """Distance of each (sequence, design) pair.
+
+        :param list seqs: Sequences.
+        :param query: Index in ``seqs`` of the sequence of each pair.
+        :param design: Design of each pair.
+        """
+        query, design = np.asarray(query), np.asarray(design)
+        dist = np.zeros(len(query), dtype=np.int64)
+        # Pairs are verified in batches of equal (sequence, design) lengths.
+        qlen = np.array([len(seqs[q]) for q in query], dtype=np.int64)
+        dlen = np.array([len(self.seqs[d]) for d in design], dtype=np.int64)
+        for la, lb in set(zip(qlen.tolist(), dlen.tolist())):
+            pairs = np.flatnonzero((qlen == la) & (dlen == lb))
+            for ini in range(0, len(pairs), BATCH):
+                batch = pairs[ini:ini + BATCH]
+                a = _as_array([seqs[q] for q in query[batch]])
+                b = _as_array([self.seqs[d] for d in design[batch]])
+                if self.indels:
+                    dist[batch] = edit_distances(a, b, self.max_dist)
+                else:
+                    dist[batch] = hamming_distances(a, b)
+        return dist
+
+    def nearest_all(self, seqs):
+        """Nearest design of each sequence within ``max_dist``.
+
+        :return: Design index of each sequence, ``-1`` if there is no
+            design within ``max_dist`` or several designs are equally
+            near, and the distances (``-1`` if unassigned).
+        """
+        nearest = np.full(len(seqs), -1, dtype=np.int64)
+        best = np.full(len(seqs), -1, dtype=np.int64)
+        query, design = [], []
+        for q, seq in enumerate(seqs):
+            if seq in self.exact:
+                nearest[q], best[q] = self.exact[seq], 0
+                continue
+            found = self.candidates(seq)
+            query.extend([q] * len(found))
+            design.extend(found)
+        if len(query) == 0:
+            return nearest, best
+
+        query, design = np.array(query), np.array(design)
+        dist = self.distances(seqs, query, design)
+        ok = dist <= self.max_dist
+        query, design, dist = query[ok], design[ok], dist[ok]
+        order = np.lexsort((dist, query))
+        query, design, dist = query[order], design[order], dist[order]
+        first = np.ones(len(query), dtype=bool)
+        first[1:] = query[1:] != query[:-1]
+        # Ties for the nearest design leave the sequence unassigned.
+        tied = np.zeros(len(query), dtype=bool)
+        tied[:-1] = (~first[1:]) & (dist[1:] == dist[:-1])
+        keep = first & ~tied
+        nearest[query[keep]] = design[keep]
+        best[query[keep]] = dist[keep]
+        return nearest, best
+
+    def nearest(self, seq):
+        """Nearest design of a sequence within ``max_dist``.
+
+        :return: Design index and distance; ``(None, None)`` if there is no
+            design within ``max_dist`` or several designs are equally near.
+        """
+        nearest, best = self.nearest_all([seq])
+        if nearest[0] < 0:
+            return None, None
+        return int(nearest[0]), int(best[0])
+
+    def assign(self, counts):
+        """Assign counted sequences to their nearest design.
+
+        :param counts: Mapping of sequence to count, in the same form as
+            the designs (e.g. the trimmed proteins of
+            :func:`.fastq.count_fastq`). Each distinct sequence is only
+            looked up once.
+
+        :return: :class:`~collections.Counter` of design names, with
+            unassigned sequences under :data:`None`.
+        """
+        seqs = list(counts.keys())
+        nearest, _ = self.nearest_all(seqs)
+        assigned = Counter()
+        for i, n in zip(nearest.tolist(), counts.values()):
+            assigned[None if i < 0 else self.names[i]] += n
+        return assigned
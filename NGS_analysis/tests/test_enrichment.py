@@ -0,0 +1,68 @@
+import os
+import sys
+from collections import Counter
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import enrichment  # noqa: E402
+
+ENRICH = {"5C4": ["10nMFab", "1uM"], "D25": ["100pM", "10nM"]}
+
+
+def conditions(seed=0):
+    rng = np.random.RandomState(seed)
+    seqs = ["".join(rng.choice(list("ACDE"), rng.randint(3, 6)))
+            for _ in range(300)]
+    counts = {}
+    for binder, conds in sorted(ENRICH.items()):
+        for cond in conds:
+            picks = rng.choice(seqs, rng.randint(50, 400))
+            counts["{}_{}".format(binder, cond)] = Counter(picks.tolist())
+    return counts
+
+
+def notebook_table(counts):
+    """func1/func2 of analyse_NGS_3hb_NGS.ipynb over counted proteins."""
+    data = [pd.DataFrame({"seq": list(c.keys()), name: list(c.values())})
+            for name, c in counts.items()]
+    df = reduce(lambda left, right: pd.merge(left, right, on="seq",
+                                             how="outer"), data).fillna(0)
+    df["len"] = df["seq"].str.len()
+    for binder, (high, low) in ENRICH.items():
+        df["enrichment_" + binder] = (df["{}_{}".format(binder, high)] /
+                                      df["{}_{}".format(binder, low)])
+    return df
+
+
+def test_enrichment_matches_notebook_merges():
+    counts = conditions()
+    matrix = enrichment.CountMatrix()
+    for name, c in counts.items():
+        matrix.add(name, c)
+    df = enrichment.enrichment(matrix, ENRICH).set_index("seq").sort_index()
+    expected = notebook_table(counts).set_index("seq").sort_index()
+    assert list(df.index) == list(expected.index)
+    for column in expected.columns:
+        assert np.allclose(df[column].astype(float),
+                           expected[column].astype(float), equal_nan=True)
+    high, low = df["D25_100pM"], df["D25_10nM"]
+    assert np.allclose(df["log2_enrichment_D25"],
+                       np.log2((high + 1) / (low + 1)))
+
+
+def test_coo_totals():
+    counts = conditions(seed=1)
+    matrix = enrichment.CountMatrix()
+    for name, c in counts.items():
+        matrix.add(name, c)
+    _, cols, values = matrix.coo()
+    assert matrix.shape == (len(set().union(*counts.values())), 4)
+    for i, name in enumerate(matrix.conditions):
+        assert values[cols == i].sum() == sum(counts[name].values())
+        column = matrix.column(name)
+        assert {s: column[r] for s, r in matrix.index.items()
+                if column[r] > 0} == dict(counts[name])
@@ -0,0 +1,114 @@
+import os
+import random
+import re
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import fastq  # noqa: E402
+
+MATCHES = ["KNY", "KE"]
+DESIGN = "SCEEAKNYIDKQLLPIVNKAGCGSAEEVQKDIEKALRNAGVKDCLEDILRGIKEIKCG"
+
+
+# Reference implementation: the functions of analyse_NGS_3hb_NGS.ipynb.
+def notebook_translate_dna_sequence(sequence):
+    protein = ""
+    for start in range(0, len(sequence) - 2, 3):
+        protein += fastq.CODON_TABLE.get(sequence[start:start + 3], "X")
+    return protein
+
+
+def notebook_translate_3frames(sequence, matches):
+    frames = [notebook_translate_dna_sequence(sequence[i:])
+              for i in range(3)]
+    counts = [sum(1 for m in matches if re.search(m, p)) for p in frames]
+    try:
+        return frames[counts.index(len(matches))]
+    except ValueError:
+        return ""
+
+
+def notebook_adapt_length(seq):
+    m = re.search("AS(.*)GS", seq)
+    return m.group(1) if m else seq
+
+
+def notebook_counts(reads, matches):
+    return Counter(notebook_adapt_length(notebook_translate_3frames(r,
+                                                                    matches))
+                   for r in reads)
+
+
+def random_reads(n, seed=0):
+    """Reads of mutated, flanked designs in random frames, with some
+    unknown bases, stop codons, truncations and pure noise."""
+    rng = random.Random(seed)
+    codons = {}
+    for codon, aa in sorted(fastq.CODON_TABLE.items()):
+        codons.setdefault(aa, []).append(codon)
+    pool = []
+    for _ in range(n // 4):
+        protein = list("GAS" + DESIGN + "GSGL")
+        for _ in range(rng.randint(0, 3)):
+            protein[rng.randrange(len(protein))] = rng.choice(
+                "ACDEFGHIKLMNPQRSTVWY_")
+        dna = "".join(rng.choice(codons[aa]) for aa in protein)
+        dna = "ACGT"[rng.randrange(4)] * rng.randint(0, 2) + dna
+        if rng.random() < 0.1:
+            pos = rng.randrange(len(dna))
+            dna = dna[:pos] + "N" + dna[pos + 1:]
+        if rng.random() < 0.1:
+            dna = dna[:rng.randrange(len(dna))]
+        if rng.random() < 0.05:
+            dna = "".join(rng.choice("ACGT") for _ in range(len(dna)))
+        pool.append(dna + ">" * rng.randint(0, 1))
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def write_fastq(filename, reads):
+    with open(filename, "w") as fd:
+        for i, seq in enumerate(reads):
+            fd.write("@read{}\n{}\n+\n{}\n".format(i, seq, "F" * len(seq)))
+
+
+def test_translate_frame_matches_notebook():
+    reads = [r.rstrip(">") for r in random_reads(200)] + ["", "A", "ACGTN"]
+    for frame in range(3):
+        joined, offsets, counts = fastq.translate_frame(reads, frame)
+        proteins = [joined[o:o + c] for o, c in zip(offsets, counts)]
+        assert proteins == [notebook_translate_dna_sequence(r[frame:])
+                            for r in reads]
+
+
+def test_translate_3frames_matches_notebook():
+    reads = [r.rstrip(">") for r in random_reads(400, seed=1)]
+    assert fastq.translate_3frames(reads, MATCHES) == [
+        notebook_translate_3frames(r, MATCHES) for r in reads]
+    trimmed = fastq.adapt_length(fastq.translate_3frames(reads, MATCHES))
+    assert trimmed == [notebook_adapt_length(
+        notebook_translate_3frames(r, MATCHES)) for r in reads]
+
+
+def test_count_fastq_matches_notebook(tmpdir):
+    reads = random_reads(2000, seed=2)
+    filename = os.path.join(str(tmpdir), "reads.fastq")
+    write_fastq(filename, reads)
+    expected = notebook_counts([r.rstrip(">") for r in reads], MATCHES)
+    assert len(expected) > 10 and expected[""] > 0
+
+    # A single chunk, and chunks of distinct reads over a process pool.
+    assert fastq.count_fastq(filename, MATCHES) == expected
+    assert fastq.count_fastq(filename, MATCHES, processes=2,
+                             chunksize=50) == expected
+
+    # Cached read counts give the same proteins.
+    fastq.count_fastq(filename, MATCHES, cache=True)
+    assert os.path.isfile(filename + ".counts.npz")
+    assert fastq.count_fastq(filename, MATCHES, cache=True) == expected
+
+    df = fastq.read_count_fastq("D25_100pM", filename, MATCHES)
+    assert list(df.columns) == ["seq", "D25_100pM"]
+    assert dict(zip(df["seq"], df["D25_100pM"])) == dict(expected)
+    assert df["D25_100pM"].is_monotonic_decreasing
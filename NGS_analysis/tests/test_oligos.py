@@ -0,0 +1,125 @@
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import fastq  # noqa: E402
+import oligos  # noqa: E402
+
+MATCHES = ["KNY", "KE"]
+DESIGN = "SCEEAKNYIDKQLLPIVNKAGCGSAEEVQKDIEKALRNAGVKDCLEDILRGIKEIKCG"
+
+
+def mutate(rng, seq, n, alphabet, indels=False, keep=""):
+    seq = list(seq)
+    for _ in range(n):
+        op = rng.choice(["sub", "ins", "del"]) if indels else "sub"
+        pos = rng.choice([i for i, c in enumerate(seq) if c not in keep])
+        if op == "sub":
+            seq[pos] = rng.choice(alphabet)
+        elif op == "ins":
+            seq.insert(pos, rng.choice(alphabet))
+        else:
+            del seq[pos]
+    return "".join(seq)
+
+
+def brute_force(index, seq):
+    """Nearest design by comparing to every design."""
+    dist = []
+    for design in index.seqs:
+        if index.indels:
+            dist.append(oligos.edit_distance(seq, design, index.max_dist))
+        elif len(design) == len(seq):
+            dist.append(sum(a != b for a, b in zip(seq, design)))
+        else:
+            dist.append(index.max_dist + 1)
+    best = min(dist)
+    if best > index.max_dist or dist.count(best) > 1:
+        return -1
+    return dist.index(best)
+
+
+def library(rng, n=40, alphabet="ACDE"):
+    return [("d{}".format(i),
+             "".join(rng.choice(alphabet) for _ in range(rng.randint(12, 16))))
+            for i in range(n)]
+
+
+def check_against_brute_force(indels):
+    rng = random.Random(0)
+    designs = library(rng)
+    index = oligos.OligoIndex(designs, max_dist=2, indels=indels)
+    queries = [mutate(rng, rng.choice(designs)[1], rng.randint(0, 4), "ACDE",
+                      indels) for _ in range(500)]
+    nearest, best = index.nearest_all(queries)
+    expected = [brute_force(index, q) for q in queries]
+    assert nearest.tolist() == expected
+    assigned = nearest >= 0
+    assert 0 < assigned.sum() < len(queries)
+    assert np.all(best[assigned] <= 2) and np.all(best[~assigned] == -1)
+
+
+def test_hamming_matches_brute_force():
+    check_against_brute_force(indels=False)
+
+
+def test_edit_distance_matches_brute_force():
+    check_against_brute_force(indels=True)
+
+
+def test_edit_distances():
+    rng = random.Random(1)
+    a = ["".join(rng.choice("AC") for _ in range(7)) for _ in range(200)]
+    b = ["".join(rng.choice("AC") for _ in range(9)) for _ in range(200)]
+    dist = oligos.edit_distances(oligos._as_array(a), oligos._as_array(b), 3)
+    assert dist.tolist() == [oligos.edit_distance(x, y, 3)
+                             for x, y in zip(a, b)]
+
+
+def reverse_translate(rng, protein):
+    codons = {}
+    for codon, aa in sorted(fastq.CODON_TABLE.items()):
+        codons.setdefault(aa, []).append(codon)
+    return "".join(rng.choice(codons[aa]) for aa in protein)
+
+
+def test_assign_trimmed_reads(tmpdir):
+    rng = random.Random(2)
+    # Mutations keep the anchors and do not add trimming sites.
+    alphabet, keep = "ADFGHILMPQRTVW", "KNYE"
+    proteins = [DESIGN] + [mutate(rng, DESIGN, 4, alphabet, keep=keep)
+                           for _ in range(5)]
+    fasta = os.path.join(str(tmpdir), "oligos.fasta")
+    with open(fasta, "w") as fd:
+        fd.write("# Oligo sequences\n")
+        for i, p in enumerate(proteins):
+            fd.write(">design{}\n{}\n".format(
+                i, reverse_translate(rng, "GAS" + p + "GSGL")))
+
+    # Reads with their own codons, a random frame, flanks and up to one
+    # amino acid error.
+    reads, expected = [], {}
+    for i in range(300):
+        k = rng.randrange(len(proteins))
+        errors = rng.randint(0, 1)
+        p = mutate(rng, proteins[k], errors, alphabet, keep=keep)
+        reads.append("A" * rng.randint(0, 2) +
+                     reverse_translate(rng, "GAS" + p + "GSGL") + "TTGA")
+        expected.setdefault("design{}".format(k), 0)
+        expected["design{}".format(k)] += 1
+    filename = os.path.join(str(tmpdir), "reads.fastq")
+    with open(filename, "w") as fd:
+        for i, seq in enumerate(reads):
+            fd.write("@read{}\n{}\n+\n{}\n".format(i, seq, "F" * len(seq)))
+
+    index = oligos.OligoIndex.from_fasta(fasta, max_dist=1, matches=MATCHES)
+    assert index.seqs[0] == DESIGN
+    assigned = index.assign(fastq.count_fastq(filename, MATCHES))
+    assert dict(assigned) == expected
+
+    # Untrimmed reads keep their flanks and are not assigned.
+    assert list(index.assign(fastq.count_reads(filename))) == [None]
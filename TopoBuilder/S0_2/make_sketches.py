@@ -11,8 +11,15 @@ Prototype of the Parametric-Design motif fitter: TopoBuilder.
 # Standard Libraries
 import sys
 import os
+import json
+import shutil
+import hashlib
+import itertools
+import multiprocessing
 
 # External Libraries
+import numpy as np
+import pandas as pd
 from libconfig.config import _get_repo
 
 # This Library
@@ -22,73 +29,308 @@ from parametric import VirtualStructure as VS
 from parametric import VirtualReverse as VR
 from parametric import VirtualHelixAlpha as VH
 
+EPITOPE = os.path.join(DENOVO, 'DNS0', 'epitope', 'site0_extended_center.pdb')
+FILES = ['sketch.pdb', 'sketch.fa', 'constraints.cst', 'peptide.xml']
+MARKER = 'sketch.json'
+CA_CA = 3.8  # Distance between consecutive CA (A)
+HASH_DECIMALS = 6  # Rounding of variant parameters when hashing them
 
-def main():
-    # Load the epitope and split the two parts
-    epitope = VR(os.path.join(DENOVO, 'DNS0', 'epitope',
-                              'site0_extended_center.pdb'))
+# The three backbone orientations described in S0_bb*.json.
+VARIANTS = [
+    {'loops': [1, 4, 3, 1], 'length': 20, 'shift': [5, 0, 0],
+     'tilt': [0, 0, 25]},
+    {'loops': [1, 3, 3, 1], 'length': 20, 'shift': [5, 0, 0],
+     'tilt': [0, 0, 0]},
+    {'loops': [1, 3, 8, 1], 'length': 15, 'shift': [0.5, 0.5, 0.],
+     'tilt': [0, -40, -45]},
+]
+
+# Epitope of the current process and constraints between its two parts,
+# which only depend on where they are placed in the sequence.
+_EPITOPE = None
+_EPITOPE_CONSTRAINTS = {}
+
+
+def load_epitope():
+    """Load the epitope and split the two parts.
+    """
+    epitope = VR(EPITOPE)
     epi1, epi2 = VS(21), VS(14)
     epi1.residues = epitope.residues[:21]
     epi1.restype = epitope.restype[:21]
     epi2.residues = epitope.residues[21:]
     epi2.restype = epitope.restype[21:]
+    return epi1, epi2
+
+
+def make_helix(variant):
+    """Target helix of a sketch variant (tilts are applied as x, y, z).
+    """
+    helix = VH(variant['length'], list(variant['shift']), flip=True)
+    for axis, angle in enumerate(variant['tilt']):
+        if angle != 0:
+            tilt = [0, 0, 0]
+            tilt[axis] = angle
+            helix.tilt(*tilt)
+    return helix
+
+
+def build_sketch(variant, epitope=None):
+    """Build the sketch files of a variant.
+
+    :return: Content of each of :data:`FILES`, the epitope ranges and the
+        secondary structure.
+    """
+    epi1, epi2 = _EPITOPE if epitope is None else epitope
+    loops = variant['loops']
+    helix = make_helix(variant)
+    current_len = 1
+    structure, sequence, constraints, ss = [], ['G', ], [], ['L']
+    xml = ['<Append resname="GLY" />', ]
+    query = [epi1, helix, epi2]
+    for i, sse in enumerate(query):
+        current_len += loops[i]
+        structure.append(sse.write(current_len))
+        sequence.append(sse.fasta())
+        ss.extend([sse._SS, ] * len(sse))
+        sequence.extend(['G', ] * loops[i + 1])
+        ss.extend(['L', ] * loops[i + 1])
+        xml.extend(sse.xml())
+        xml.extend(['<Append resname="GLY" />', ] * loops[i + 1])
+        constraints.extend(sse.constraints())
+        current_len += len(sse)
+    key = (epi1.ini, epi2.ini)
+    if key not in _EPITOPE_CONSTRAINTS:
+        _EPITOPE_CONSTRAINTS[key] = epi1.constraints(epi2)
+    constraints.extend(epi1.constraints(helix))
+    constraints.extend(_EPITOPE_CONSTRAINTS[key])
+    constraints.extend(helix.constraints(epi2))
+    files = {'sketch.pdb': '\n'.join(structure),
+             'sketch.fa': '>sketch\n' + ''.join(sequence),
+             'constraints.cst': '\n'.join(constraints),
+             'peptide.xml': '\n'.join(xml)}
+    ranges = '{}-{},{}-{}'.format(epi1.ini, epi1.ini + len(epi1) - 1,
+                                  epi2.ini, epi2.ini + len(epi2) - 1)
+    return files, ranges, ''.join(ss)
+
+
+def epitope_hash():
+    with open(EPITOPE, 'rb') as fd:
+        return hashlib.sha1(fd.read()).hexdigest()
+
+
+def ca_coordinates(pdb):
+    """CA coordinates of a PDB block, as written by ``sse.write``.
+    """
+    ca = [line for line in pdb.split('\n') if line[12:16] == ' CA ']
+    return np.array([[float(line[30:38]), float(line[38:46]),
+                      float(line[46:54])] for line in ca]).reshape(-1, 3)
+
+
+def helix_coordinates(variants):
+    """CA coordinates of the helix of each variant.
+
+    Helices are only built once per placement (length, shift and tilt).
+
+    :return: Array of shape (variants, longest helix, 3), padded with NaN,
+        and the length of each helix.
+    """
+    placements, helices = {}, []
+    for variant in variants:
+        key = (variant['length'], tuple(variant['shift']),
+               tuple(variant['tilt']))
+        if key not in placements:
+            placements[key] = ca_coordinates(make_helix(variant).write(1))
+        helices.append(placements[key])
+    lengths = np.array([len(h) for h in helices], dtype=int)
+    xyz = np.full((len(helices), lengths.max(initial=1), 3), np.nan)
+    for i, h in enumerate(helices):
+        xyz[i, :len(h)] = h
+    return xyz, lengths
+
+
+def prefilter(variants, epitope=None, clash=4.0, contact=12.0):
+    """Geometric screen of sketch variants before building and folding them.
+
+    For all variants at once, checks that the helix does not clash with the
+    epitope (CA pairs closer than ``clash``), that each connecting loop can
+    span the gap it closes (at most :data:`CA_CA` per virtual bond) and
+    that the helix packs against both epitope segments (closest CA within
+    ``contact``), i.e. that the inter-SSE ``AtomPair`` constraints describe
+    a compact fold.
+
+    :return: :class:`~pandas.DataFrame` with one row per variant and a
+        ``feasible`` column.
+    """
+    epi1, epi2 = load_epitope() if epitope is None else epitope
+    e1, e2 = ca_coordinates(epi1.write(1)), ca_coordinates(epi2.write(1))
+    xyz, lengths = helix_coordinates(variants)
+    loops = np.array([v['loops'] for v in variants]).reshape(-1, 4)
+
+    # Padded positions are infinitely far from everything.
+    d1 = np.linalg.norm(xyz[:, :, None] - e1[None, None], axis=3)
+    d2 = np.linalg.norm(xyz[:, :, None] - e2[None, None], axis=3)
+    d1[np.isnan(d1)] = np.inf
+    d2[np.isnan(d2)] = np.inf
+    last = xyz[np.arange(len(xyz)), np.maximum(lengths - 1, 0)]
+    df = pd.DataFrame({
+        'clashes': (np.sum(d1 < clash, axis=(1, 2)) +
+                    np.sum(d2 < clash, axis=(1, 2))),
+        'gap1': np.linalg.norm(xyz[:, 0] - e1[-1], axis=1),
+        'span1': CA_CA * (loops[:, 1] + 1),
+        'gap2': np.linalg.norm(e2[0] - last, axis=1),
+        'span2': CA_CA * (loops[:, 2] + 1),
+        'contact1': d1.min(axis=(1, 2), initial=np.inf),
+        'contact2': d2.min(axis=(1, 2), initial=np.inf)})
+    df['feasible'] = ((df['clashes'] == 0) &
+                      (df['gap1'] <= df['span1']) &
+                      (df['gap2'] <= df['span2']) &
+                      (df['contact1'] <= contact) &
+                      (df['contact2'] <= contact))
+    return df
 
-    # Define the different target helices
-    loops = []
-    loops.append([1, 4, 3, 1])
-    helix1 = VH(20, [5, 0, 0], flip=True)
-    helix1.tilt(0, 0, 25)
 
+def canonical_variant(value):
+    """Variant (or any of its values) with all numbers as Python floats
+    rounded to :data:`HASH_DECIMALS`, so that ``1``, ``1.0`` and NumPy
+    scalars give the same hash.
+    """
+    if isinstance(value, dict):
+        return {k: canonical_variant(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [canonical_variant(v) for v in value]
+    return round(float(value), HASH_DECIMALS) + 0.0  # No -0.0
 
-    loops.append([1, 3, 3, 1])
-    helix2 = VH(20, [5, 0, 0], flip=True)
 
-    loops.append([1, 3, 8, 1])
-    helix3 = VH(15, [0.5, 0.5, 0.], flip=True)
-    helix3.tilt(0, -40, 0)
-    helix3.tilt(0, 0, -45)
+def variant_hash(variant, epitope=None):
+    """Content hash of a variant and of the epitope it is built around.
+
+    :param str epitope: Precomputed :func:`epitope_hash`.
+    """
+    sha = hashlib.sha1((epitope_hash() if epitope is None else epitope)
+                       .encode())
+    sha.update(json.dumps(canonical_variant(variant),
+                          sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def variant_grid(loops, lengths, shift_x, shift_y, tilt_y, tilt_z,
+                 shift_z=(0, ), tilt_x=(0, )):
+    """All combinations of loop lengths and helix placements.
+
+    :param list loops: Loop lengths (lists of four values) to try.
+    :param list lengths: Helix lengths.
+    :param list shift_x: Helix shifts; also ``shift_y`` and ``shift_z``.
+    :param list tilt_y: Helix tilts (degrees); also ``tilt_x``, ``tilt_z``.
+
+    :return: List of variants.
+    """
+    return [{'loops': list(lp), 'length': ln, 'shift': [sx, sy, sz],
+             'tilt': [tx, ty, tz]}
+            for lp, ln, sx, sy, sz, tx, ty, tz in itertools.product(
+                loops, lengths, shift_x, shift_y, shift_z,
+                tilt_x, tilt_y, tilt_z)]
+
+
+def config_grid(config, loops):
+    """Variants described by the helix layer of a ``S0_bb*.json`` config.
+
+    Any of ``length``, ``shift_x``, ``shift_y``, ``tilt_y`` and ``tilt_z``
+    can be a list of values instead of a single one, to define a grid.
+    """
+    with open(config) as fd:
+        helix = json.load(fd)['layers'][0][0]
+
+    def values(key):
+        value = helix.get(key, 0)
+        return value if isinstance(value, list) else [value]
+    return variant_grid(loops, values('length'), values('shift_x'),
+                        values('shift_y'), values('tilt_y'),
+                        values('tilt_z'), values('shift_z'), values('tilt_x'))
+
+
+def _init_worker():
+    global _EPITOPE
+    _EPITOPE = load_epitope()
+
+
+def _write_sketch(job):
+    """Build a variant into its own folder; the marker is written last.
+    """
+    wdir, variant = job
+    files, ranges, ss = build_sketch(variant)
+    tmp = wdir + '.tmp'
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name in FILES:
+        with open(os.path.join(tmp, name), 'w') as fd:
+            fd.write(files[name])
+    with open(os.path.join(tmp, MARKER), 'w') as fd:
+        json.dump({'variant': canonical_variant(variant), 'ranges': ranges,
+                   'ss': ss}, fd)
+    if os.path.isdir(wdir):
+        shutil.rmtree(wdir)
+    os.rename(tmp, wdir)
+    return wdir, ranges, ss
+
+
+def make_sketches(variants, outdir='sketches', processes=None):
+    """Build many sketch variants in a process pool.
+
+    Each variant is written to ``<outdir>/<hash>`` (see
+    :func:`variant_hash`); variants whose folder is already complete are
+    not built again.
+
+    Equal variants (e.g. ``1`` and ``1.0``) share their folder and are
+    built once.
+
+    :return: Working folder, epitope ranges and secondary structure of
+        each variant, in the order of ``variants``.
+    """
+    wdirs, todo, queued = [], [], set()
+    epitope = epitope_hash()
+    for variant in variants:
+        wdirs.append(os.path.join(outdir, variant_hash(variant, epitope)))
+        if wdirs[-1] in queued:
+            continue
+        if not os.path.isfile(os.path.join(wdirs[-1], MARKER)):
+            todo.append((wdirs[-1], variant))
+            queued.add(wdirs[-1])
+    if len(todo) > 0:
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        try:
+            for _ in pool.imap_unordered(_write_sketch, todo, chunksize=16):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    result = []
+    for wdir in wdirs:
+        with open(os.path.join(wdir, MARKER)) as fd:
+            data = json.load(fd)
+        result.append((wdir, data['ranges'], data['ss']))
+    return result
+
+
+def main():
+    epitope = load_epitope()
 
     # Create each structure
     wdirs = []
-    for ih, helix in enumerate([helix1, helix2, helix3]):
+    for ih, variant in enumerate(VARIANTS):
         wdir = 'bb{}'.format(ih + 1)
-        current_len = 1
-        structure, sequence, constraints, ss = [], ['G', ], [], ['L']
-        xml = ['<Append resname="GLY" />', ]
-        query = [epi1, helix, epi2]
-        for i, sse in enumerate(query):
-            current_len += loops[ih][i]
-            structure.append(sse.write(current_len))
-            sequence.append(sse.fasta())
-            ss.extend([sse._SS, ] * len(sse))
-            sequence.extend(['G', ] * loops[ih][i + 1])
-            ss.extend(['L', ] * loops[ih][i + 1])
-            xml.extend(sse.xml())
-            xml.extend(['<Append resname="GLY" />', ] * loops[ih][i + 1])
-            constraints.extend(sse.constraints())
-            current_len += len(sse)
-        for i, sse in enumerate(query):
-            for jsse in query[i + 1:]:
-                constraints.extend(sse.constraints(jsse))
+        files, ranges, ss = build_sketch(variant, epitope)
         if not os.path.isdir(wdir):
             os.mkdir(wdir)
-        if not os.path.isfile(os.path.join(wdir, 'sketch.pdb')):
-            with open(os.path.join(wdir, 'sketch.pdb'), 'w') as fd:
-                fd.write('\n'.join(structure))
-        if not os.path.isfile(os.path.join(wdir, 'sketch.fa')):
-            with open(os.path.join(wdir, 'sketch.fa'), 'w') as fd:
-                fd.write('>sketch\n')
-                fd.write(''.join(sequence))
-        if not os.path.isfile(os.path.join(wdir, 'constraints.cst')):
-            with open(os.path.join(wdir, 'constraints.cst'), 'w') as fd:
-                fd.write('\n'.join(constraints))
-        if not os.path.isfile(os.path.join(wdir, 'peptide.xml')):
-            with open(os.path.join(wdir, 'peptide.xml'), 'w') as fd:
-                fd.write('\n'.join(xml))
-        wdirs.append((wdir,
-                      '{}-{},{}-{}'.format(epi1.ini, epi1.ini + len(epi1) - 1,
-                                           epi2.ini, epi2.ini + len(epi2) - 1),
-                      ''.join(ss)))
+        for name in FILES:
+            if not os.path.isfile(os.path.join(wdir, name)):
+                with open(os.path.join(wdir, name), 'w') as fd:
+                    fd.write(files[name])
+        wdirs.append((wdir, ranges, ss))
     return wdirs
 
 
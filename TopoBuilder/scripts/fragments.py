@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store of picked fragments, shared by all backbone
+variants.
+
+Fragments picked for a window of the query only depend on the sequence and
+``structure.ss2`` rows of that window, on the vall database and on the
+number of fragments per position. Each frame of a Rosetta fragment file
+(``frags.200.3mers``, ``frag_1.200.9mers``, ...) is stored under the hash of
+those, so variants sharing long identical segments (e.g. the epitope) only
+need fragments to be picked for the windows that differ::
+
+    store = FragmentStore('fragments.store')
+    missing = store.assemble('sketch.fa', 'structure.ss2', VALL, 3, 200,
+                             'frag_1.200.3mers')
+    if missing:  # pick fragments, then
+        store.add_file('frag_1.200.3mers', 'sketch.fa', 'structure.ss2', VALL)
+
+The store is a folder with one ``<key[:2]>/<key>.npy`` file per window.
+Each file is written under a temporary name and renamed into place, so
+readers never see a partial window and concurrent tasks can store the same
+windows safely.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+FRAGMENT = np.dtype([('resnum', '<i4'), ('pdb', 'S4'), ('kind', 'S9'),
+                     ('aa', 'S1'), ('ss', 'S1'), ('phi', '<f4'),
+                     ('psi', '<f4'), ('omega', '<f4')])
+FRAME = 'FRAME{:>5d}{:>4d}'
+LINE = '{:>10d}{:>6d} {} {} {} {}{:>11.3f}{:>10.3f}{:>10.3f}'
+
+
+def read_fragments(filename):
+    """Read a Rosetta fragment file.
+
+    :return: List of ``(start, fragments)`` per frame, ``fragments`` being
+        an array of :data:`FRAGMENT` of shape (fragments, frame size).
+    """
+    frames, start, size, rows = [], None, None, []
+
+    def frame():
+        return start, np.array(rows, dtype=FRAGMENT).reshape(-1, size)
+
+    with open(filename) as fd:
+        for line in fd:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            if fields[0] == 'FRAME':
+                if start is not None:
+                    frames.append(frame())
+                start, rows = int(fields[1]), []
+                size = int(fields[2]) - start + 1
+                continue
+            rows.append((int(fields[1]), fields[2], fields[3], fields[4],
+                         fields[5], float(fields[6]), float(fields[7]),
+                         float(fields[8])))
+    if start is not None:
+        frames.append(frame())
+    return frames
+
+
+def write_fragments(frames, filename):
+    """Write frames (see :func:`read_fragments`) as a Rosetta fragment file.
+    """
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fd:
+        for start, data in frames:
+            size = data.shape[1]
+            fd.write(FRAME.format(start, start + size - 1) + '\n')
+            for fragment in data:
+                for i, r in enumerate(fragment):
+                    fd.write(LINE.format(
+                        start + i, r['resnum'], r['pdb'].decode(),
+                        r['kind'].decode(), r['aa'].decode(),
+                        r['ss'].decode(), r['phi'], r['psi'],
+                        r['omega']) + '\n')
+                fd.write('\n\n')
+    os.replace(tmp, filename)
+
+
+def read_sequence(filename):
+    """Sequence of a single-record FASTA file.
+    """
+    with open(filename) as fd:
+        return ''.join(line.strip() for line in fd
+                       if not line.startswith('>'))
+
+
+def read_ss2(filename):
+    """Rows of a PSIPRED ``.ss2`` file, without the residue number.
+    """
+    rows = []
+    with open(filename) as fd:
+        for line in fd:
+            fields = line.split()
+            if len(fields) == 6 and not line.startswith('#'):
+                rows.append(' '.join(fields[1:]))
+    return rows
+
+
+def window_keys(sequence, ss2, vall, size, nfrags):
+    """Key of each fragment window (1-based start position -> key).
+
+    :param str sequence: Query sequence.
+    :param list ss2: Rows of the query's ``.ss2`` (see :func:`read_ss2`).
+    :param str vall: Vall database; its file name identifies its version.
+    """
+    if len(ss2) != len(sequence):
+        raise ValueError('sequence and ss2 lengths differ: {} != {}'.format(
+            len(sequence), len(ss2)))
+    base = '{}|{}|{}'.format(os.path.basename(vall), size, nfrags)
+    keys = {}
+    for i in range(len(sequence) - size + 1):
+        window = '|'.join([base, sequence[i:i + size]] + ss2[i:i + size])
+        keys[i + 1] = hashlib.sha1(window.encode()).hexdigest()
+    return keys
+
+
+def query_keys(fasta, ss2_file, vall, size, nfrags):
+    """Window keys (see :func:`window_keys`) of a query given as a FASTA
+    and a ``.ss2`` file.
+    """
+    return window_keys(read_sequence(fasta), read_ss2(ss2_file), vall, size,
+                       nfrags)
+
+
+class FragmentStore(object):
+    """Content-addressed fragment windows in a folder.
+
+    :param str path: Store folder (created if needed).
+    """
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.npy')
+
+    def __contains__(self, key):
+        return os.path.isfile(self._file(key))
+
+    def __len__(self):
+        return sum(len([f for f in os.listdir(os.path.join(self.path, d))
+                        if f.endswith('.npy') and not f.startswith('.')])
+                   for d in os.listdir(self.path)
+                   if os.path.isdir(os.path.join(self.path, d)))
+
+    def get(self, key):
+        """Fragments of a window, of shape (fragments, size).
+        """
+        return np.load(self._file(key))
+
+    def put(self, key, fragments):
+        """Store the fragments of a window (ignored if already there).
+
+        The window is written to a temporary file in the same folder and
+        renamed into place.
+        """
+        if key in self:
+            return
+        fragments = np.ascontiguousarray(fragments, dtype=FRAGMENT)
+        folder = os.path.dirname(self._file(key))
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.' + key, suffix='.tmp',
+                                   dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                np.save(out, fragments)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+            raise
+
+    def add_file(self, filename, fasta, ss2_file, vall):
+        """Store all frames of a picked fragment file.
+
+        :param str fasta: FASTA file of the query.
+        :param str ss2_file: ``.ss2`` file of the query.
+
+        :return: Number of new windows.
+        """
+        frames = read_fragments(filename)
+        if len(frames) == 0:
+            return 0
+        nfrags, size = frames[0][1].shape
+        keys = query_keys(fasta, ss2_file, vall, size, nfrags)
+        new = 0
+        for start, data in frames:
+            if keys[start] not in self:
+                self.put(keys[start], data)
+                new += 1
+        return new
+
+    def missing(self, fasta, ss2_file, vall, size, nfrags):
+        """Start positions of the windows not in the store.
+        """
+        keys = query_keys(fasta, ss2_file, vall, size, nfrags)
+        return [p for p in sorted(keys) if keys[p] not in self]
+
+    def assemble(self, fasta, ss2_file, vall, size, nfrags, outfile):
+        """Write the fragment file of a query if all windows are stored.
+
+        :return: Start positions of the missing windows (the file is only
+            written if there are none).
+        """
+        keys = query_keys(fasta, ss2_file, vall, size, nfrags)
+        missing = [p for p in sorted(keys) if keys[p] not in self]
+        if len(missing) == 0:
+            write_fragments([(p, self.get(keys[p])) for p in sorted(keys)],
+                            outfile)
+        return missing
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+Dependency-driven execution of the TopoBuilder folding runs.
+
+Replaces the fragment barrier of ``submiter.sbatch`` (all array tasks but
+the first polling for ``frag_1.200.3mers``) with a small DAG of stages::
+
+    fragments (task 1) -> fold (tasks 2..N) -> merge (minisilent)
+
+Each task packs its own silent output into a gzip member as soon as it is
+done, so that the final merge only needs to concatenate them. The merge
+runs once all folding tasks finished, whether they succeeded or not
+(``afterany`` on SLURM, so a failed task cannot leave it pending forever):
+it merges the outputs of the completed tasks and then fails if any task
+is missing, so that re-running the pipeline re-runs the failed tasks and
+merges again.
+
+Each task leaves a completion marker in ``<workdir>/.pipeline`` once its
+command succeeded and its outputs exist, so runs can be resumed and no
+stage ever reads partially written inputs. A pipeline runs either locally,
+starting each stage as soon as the stages it depends on are complete
+(with a stand-in for the Rosetta binaries for testing), or on SLURM, as
+array jobs chained by ``--dependency=afterok`` (``afterany`` for the
+merge)::
+
+    python pipeline.py run S0_2/bb1 S0_bb1_B1H_A1H_B2C --local --stub -n 8
+    python pipeline.py run S0_2/bb1 S0_bb1_B1H_A1H_B2C && sh S0_2/bb1/submit.sh
+"""
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from . import silent
+except ImportError:
+    import silent
+
+ROSETTA = '/work/upcorreia/bin/devel/Rosetta/main/source/bin/' \
+          'fold_from_loops.linuxgccrelease'
+VALL = '/work/upcorreia/databases/vall.2011.07/vall.jul19.2011.gz'
+MARKERS = '.pipeline'
+SBATCH = OrderedDict([('nodes', 1), ('ntasks-per-node', 1),
+                      ('cpus-per-task', 1), ('mem', 8192),
+                      ('time', '16:00:00')])
+
+# Programs as run on the cluster, and locally with the Rosetta stand-in.
+PROGRAMS = {'fold_from_loops': [ROSETTA], 'python': ['python']}
+STUB_PROGRAMS = {'fold_from_loops': [sys.executable, os.path.abspath(__file__),
+                                     'stub'],
+                 'python': [sys.executable]}
+
+
+class Stage(object):
+    """A step of a pipeline, run as one task per id in ``tasks``.
+
+    :param str name: Stage name (an identifier).
+    :param list command: Program (a key of :data:`PROGRAMS`, or a path) and
+        arguments; ``{task}`` is replaced by the task id.
+    :param list after: Stages that must be complete before this one.
+    :param list tasks: Task ids.
+    :param list outputs: Files (with ``{task}``) a task must leave behind.
+    :param list then: Commands run by each task after ``command``.
+    :param bool partial: Run once the stages in ``after`` finished, even if
+        some of their tasks failed.
+    """
+    def __init__(self, name, command, after=(), tasks=(1, ), outputs=(),
+                 then=(), partial=False):
+        if re.match(r'^[A-Za-z_]\w*$', name) is None:
+            raise ValueError('invalid stage name: {}'.format(name))
+        self.name = name
+        self.command = list(command)
+        self.after = list(after)
+        self.tasks = list(tasks)
+        self.outputs = list(outputs)
+        self.then = [list(c) for c in then]
+        self.partial = partial
+
+    def argv(self, task, programs, command=None):
+        command = self.command if command is None else command
+        argv = [a.replace('{task}', str(task)) for a in command]
+        return list(programs.get(argv[0], argv[:1])) + argv[1:]
+
+    def argvs(self, task, programs):
+        return [self.argv(task, programs, c)
+                for c in [self.command] + self.then]
+
+
+class Pipeline(object):
+    """DAG of :class:`Stage` run in a working folder.
+
+    :param str workdir: Folder where all commands run.
+    :param list folders: Folders created before anything runs.
+    """
+    def __init__(self, workdir, folders=()):
+        self.workdir = workdir
+        self.folders = list(folders)
+        self.stages = OrderedDict()
+
+    def add(self, name, command, after=(), tasks=(1, ), outputs=(),
+            then=(), partial=False):
+        for dep in after:
+            if dep not in self.stages:
+                raise ValueError('unknown stage: {}'.format(dep))
+        self.stages[name] = Stage(name, command, after, tasks, outputs, then,
+                                  partial)
+        return self.stages[name]
+
+    def marker(self, stage, task):
+        return os.path.join(self.workdir, MARKERS,
+                            '{}.{}.done'.format(stage, task))
+
+    def is_done(self, stage, task=None):
+        """Whether a task (or all tasks of a stage) completed.
+        """
+        tasks = self.stages[stage].tasks if task is None else [task]
+        return all(os.path.isfile(self.marker(stage, t)) for t in tasks)
+
+    def _prepare(self):
+        for folder in [MARKERS] + self.folders:
+            folder = os.path.join(self.workdir, folder)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+    def _run_task(self, stage, task, programs):
+        """Run one task; the marker is only created if it succeeded.
+        """
+        log = os.path.join(self.workdir, MARKERS,
+                           '{}.{}.log'.format(stage.name, task))
+        code = 0
+        with open(log, 'w') as fd:
+            for argv in stage.argvs(task, programs):
+                fd.flush()
+                code = subprocess.call(argv, cwd=self.workdir, stdout=fd,
+                                       stderr=subprocess.STDOUT)
+                if code != 0:
+                    break
+        missing = [o for o in stage.outputs
+                   if not os.path.isfile(os.path.join(
+                       self.workdir, o.replace('{task}', str(task))))]
+        if code != 0 or len(missing) > 0:
+            return False
+        marker = self.marker(stage.name, task)
+        with open(marker + '.tmp', 'w') as fd:
+            fd.write('{}\n'.format(code))
+        os.replace(marker + '.tmp', marker)
+        return True
+
+    def run_local(self, processes=None, stub=False):
+        """Run all pending tasks with at most ``processes`` at a time.
+
+        A stage starts as soon as the stages it depends on are complete
+        (or, for ``partial`` stages, finished). Other tasks depending on a
+        failed stage are not run.
+
+        :param bool stub: Use the Rosetta stand-in (see :func:`rosetta_stub`).
+        :return: List of failed ``(stage, task)``.
+        """
+        self._prepare()
+        programs = STUB_PROGRAMS if stub else \
+            dict(PROGRAMS, python=[sys.executable])
+        pending = [(s, t) for s in self.stages.values() for t in s.tasks
+                   if not self.is_done(s.name, t)]
+        failed, running = [], {}
+
+        def ready(stage):
+            if stage.partial:
+                return all(self.is_done(dep, t) or (dep, t) in failed
+                           for dep in stage.after
+                           for t in self.stages[dep].tasks)
+            return all(self.is_done(dep) for dep in stage.after)
+
+        with ThreadPoolExecutor(processes or os.cpu_count()) as pool:
+            while True:
+                for stage, task in list(pending):
+                    if ready(stage):
+                        pending.remove((stage, task))
+                        future = pool.submit(self._run_task, stage, task,
+                                             programs)
+                        running[future] = (stage.name, task)
+                if len(running) == 0:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if not future.result():
+                        failed.append(running[future])
+                    del running[future]
+        return failed
+
+    def write_slurm(self, sbatch=None, logs=None):
+        """Write one array job per stage and a ``submit.sh`` chaining them.
+
+        :param dict sbatch: ``#SBATCH`` options (default: :data:`SBATCH`).
+        :param str logs: Folder for the SLURM logs (default: the markers).
+        :return: Path of the submission script.
+        """
+        self._prepare()
+        options = SBATCH if sbatch is None else sbatch
+        logs = logs or MARKERS
+        submit = ['#!/bin/bash', 'set -e', 'cd "$(dirname "$0")"',
+                  'mkdir -p {}'.format(' '.join(
+                      shlex.quote(f) for f in
+                      OrderedDict.fromkeys([MARKERS, logs] + self.folders)))]
+        for stage in self.stages.values():
+            lines = ['#!/bin/bash']
+            lines.extend('#SBATCH --{} {}'.format(k, v)
+                         for k, v in options.items())
+            lines.append('#SBATCH --array={}'.format(_array(stage.tasks)))
+            lines.append('#SBATCH --output={}/{}.%A_%a.out'.format(
+                logs, stage.name))
+            lines.append('#SBATCH --error={}/{}.%A_%a.err'.format(
+                logs, stage.name))
+            lines.append('')
+            lines.append('set -e')
+            lines.append('TASK=${SLURM_ARRAY_TASK_ID}')
+            marker = '{}/{}.${{TASK}}.done'.format(MARKERS, stage.name)
+            lines.append('[ -e {} ] && exit 0'.format(marker))
+            for argv in stage.argvs('{task}', PROGRAMS):
+                lines.append('srun ' + ' '.join(_quote(a) for a in argv))
+            for output in stage.outputs:
+                lines.append('[ -e {} ]'.format(_quote(output)))
+            lines.append('touch {}'.format(marker))
+            script = os.path.join(MARKERS, '{}.sbatch'.format(stage.name))
+            with open(os.path.join(self.workdir, script), 'w') as fd:
+                fd.write('\n'.join(lines) + '\n')
+            after = ':'.join('${}'.format(dep) for dep in stage.after)
+            # Jobs that can never start are cancelled, which lets the
+            # partial stages after them run.
+            dependency = '--dependency={}:{} --kill-on-invalid-dep=yes ' \
+                .format('afterany' if stage.partial else 'afterok', after)
+            submit.append('{}=$(sbatch --parsable {}{})'.format(
+                stage.name, dependency if after else '', script))
+        filename = os.path.join(self.workdir, 'submit.sh')
+        with open(filename, 'w') as fd:
+            fd.write('\n'.join(submit) + '\n')
+        return filename
+
+
+def _array(tasks):
+    """SLURM ``--array`` specification of task ids (e.g. ``2-200``).
+    """
+    ranges, tasks = [], sorted(tasks)
+    for t in tasks:
+        if ranges and t == ranges[-1][1] + 1:
+            ranges[-1][1] = t
+        else:
+            ranges.append([t, t])
+    return ','.join(str(a) if a == b else '{}-{}'.format(a, b)
+                    for a, b in ranges)
+
+
+def _tasks(spec):
+    """Task ids of a SLURM ``--array`` specification (see :func:`_array`).
+    """
+    tasks = []
+    for part in spec.split(','):
+        if len(part) == 0:
+            continue
+        ini, _, end = part.partition('-')
+        tasks.extend(range(int(ini), int(end or ini) + 1))
+    return tasks
+
+
+def completed_outputs(pattern, done):
+    """Outputs of the tasks that left a completion marker.
+
+    :param str pattern: Output of a task (with ``{task}``).
+    :param list done: ``<stage>:<tasks>`` specifications (e.g.
+        ``fold:2-200``), relative to the working folder.
+    :return: Outputs of the completed tasks and the missing
+        ``(stage, task)``.
+    """
+    outputs, missing = [], []
+    for spec in done:
+        stage, _, tasks = spec.partition(':')
+        for task in _tasks(tasks):
+            if os.path.isfile(os.path.join(MARKERS, '{}.{}.done'.format(
+                    stage, task))):
+                outputs.append(pattern.replace('{task}', str(task)))
+            else:
+                missing.append((stage, task))
+    return outputs, missing
+
+
+def _quote(arg):
+    """Quote an argument for bash, leaving ``{task}`` as ``${TASK}``.
+    """
+    return '${TASK}'.join(shlex.quote(p) if p else ''
+                          for p in arg.split('{task}')) or "''"
+
+
+def design_pipeline(workdir, prefix, ntasks=200, vall=VALL,
+                    minisilent='bbdesigns.minisilent.gz'):
+    """The fold_from_loops run of ``submiter.sbatch`` as a pipeline.
+
+    Task 1 picks the fragments (and folds with them), tasks ``2..ntasks``
+    fold with those fragments, each task packs its silent file and all of
+    them are finally merged into ``minisilent``. The merge runs once all
+    folding tasks finished and fails if any of them did not complete (see
+    the module documentation).
+    """
+    silent_out = 'out/{}_{{task}}'.format(prefix)
+    pack = [['python', os.path.abspath(__file__), 'pack', silent_out]]
+    pipeline = Pipeline(workdir, folders=['out'])
+    pipeline.add('fragments',
+                 ['fold_from_loops', '@build.commands', '-in:file:vall', vall,
+                  '-out:file:frag_prefix', 'frag_{task}',
+                  '-out:prefix', '{}_{{task}}'.format(prefix),
+                  '-out:file:silent', silent_out],
+                 outputs=['frag_1.200.3mers', 'frag_1.200.9mers', silent_out],
+                 then=pack)
+    pipeline.add('fold',
+                 ['fold_from_loops', '@build.commands',
+                  '-in:file:frag3', 'frag_1.200.3mers',
+                  '-in:file:frag9', 'frag_1.200.9mers',
+                  '-out:prefix', '{}_{{task}}'.format(prefix),
+                  '-out:file:silent', silent_out],
+                 after=['fragments'], tasks=range(2, ntasks + 1),
+                 outputs=[silent_out], then=pack)
+    done = ['{}:{}'.format(s.name, _array(s.tasks))
+            for s in pipeline.stages.values() if len(s.tasks) > 0]
+    pipeline.add('merge',
+                 ['python', os.path.abspath(__file__), 'merge', minisilent,
+                  'out', '--done', silent_out] + done,
+                 after=['fragments', 'fold'], outputs=[minisilent],
+                 partial=True)
+    return pipeline
+
+
+def _option(argv, name, default=None):
+    return argv[argv.index(name) + 1] if name in argv else default
+
+
+def rosetta_stub(argv, ndecoys=2):
+    """Local stand-in for ``fold_from_loops``.
+
+    Writes the fragment files asked for with ``-out:file:frag_prefix``
+    (failing if ``-in:file:frag3``/``frag9`` do not exist) and a silent
+    file with ``ndecoys`` decoys named after ``-out:prefix``.
+    """
+    for frag in ['-in:file:frag3', '-in:file:frag9']:
+        if frag in argv and not os.path.isfile(_option(argv, frag)):
+            raise IOError('missing fragments: {}'.format(_option(argv, frag)))
+    fprefix = _option(argv, '-out:file:frag_prefix')
+    if fprefix is not None:
+        for size in [3, 9]:
+            fname = '{}.200.{}mers'.format(fprefix, size)
+            with open(fname + '.tmp', 'w') as fd:
+                fd.write('stub fragments\n')
+            os.replace(fname + '.tmp', fname)
+    prefix = _option(argv, '-out:prefix', 'stub')
+    with open(_option(argv, '-out:file:silent', prefix), 'w') as fd:
+        fd.write('SCORE: score rms description\n')
+        fd.write('REMARK BINARY SILENTFILE\n')
+        for i in range(ndecoys):
+            tag = '{}_{:04d}'.format(prefix, i + 1)
+            fd.write('SCORE: {:.3f} {:.3f} {}\n'.format(-100.0 - i, 1.0, tag))
+            fd.write('REMARK DSSP LHHHHL\n')
+            fd.write('ANNOTATED_SEQUENCE: GAAAAG {}\n'.format(tag))
+            fd.write('LAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA {}\n'.format(tag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    sub = parser.add_subparsers(dest='action')
+    run = sub.add_parser('run', help='run or submit a folding pipeline')
+    run.add_argument('workdir', help='folder with build.commands')
+    run.add_argument('prefix', help='prefix of the decoys')
+    run.add_argument('-t', '--tasks', type=int, default=200,
+                     help='number of fold_from_loops tasks')
+    run.add_argument('--vall', default=VALL, help='vall database')
+    run.add_argument('--local', action='store_true',
+                     help='run locally instead of writing SLURM jobs')
+    run.add_argument('--stub', action='store_true',
+                     help='use a stand-in for the Rosetta binaries')
+    run.add_argument('-n', '--processes', type=int, default=None,
+                     help='local tasks run at once')
+    merge = sub.add_parser('merge', help='merge silent files to minisilent')
+    merge.add_argument('outfile')
+    merge.add_argument('folder')
+    merge.add_argument('-n', '--processes', type=int, default=None,
+                       help='files packed at once')
+    merge.add_argument('--done', nargs='+', metavar=('OUTPUT', 'STAGE'),
+                       help='only merge the OUTPUT (with {task}) of tasks '
+                       'completed in each STAGE:TASKS, failing if some are '
+                       'missing')
+    pack = sub.add_parser('pack', help='pack a silent file for merging')
+    pack.add_argument('silent')
+    sub.add_parser('stub', help='stand-in for fold_from_loops')
+    args, extra = parser.parse_known_args(argv)
+
+    if args.action == 'stub':
+        rosetta_stub(extra)
+    elif args.action == 'merge':
+        missing = []
+        if args.done is not None:
+            sources, missing = completed_outputs(args.done[0], args.done[1:])
+        else:
+            sources = sorted(os.path.join(args.folder, f)
+                             for f in os.listdir(args.folder)
+                             if not f.endswith(('.mgz', '.json', '.tmp')))
+        silent.merge_minisilent(sources, args.outfile, args.processes)
+        for stage, task in missing:
+            sys.stderr.write('not merged: {} {}\n'.format(stage, task))
+        return 1 if missing else 0
+    elif args.action == 'pack':
+        silent.pack_minisilent(args.silent, write=True)
+    elif args.action == 'run':
+        pipeline = design_pipeline(args.workdir, args.prefix, args.tasks,
+                                   args.vall)
+        if args.local:
+            failed = pipeline.run_local(args.processes, args.stub)
+            for stage, task in failed:
+                sys.stderr.write('failed: {} {}\n'.format(stage, task))
+            return 1 if failed else 0
+        print(pipeline.write_slurm())
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
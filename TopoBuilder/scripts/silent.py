@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reader for the (mini)silent files produced by the TopoBuilder
+and sequence design runs (``bbdesigns.minisilent.gz``,
+``siteIV_bb*_minisilent.gz``).
+
+Only ``SCORE`` lines and selected ``REMARK`` records are read; coordinates
+are skipped. Decoys are produced in chunks, restricted to the requested
+columns and, optionally, filtered by a :meth:`pandas.DataFrame.query`
+expression while streaming::
+
+    df = read_silent('siteIV_bb1_minisilent.gz',
+                     ['score', 'RMSD', 'match_probability'],
+                     query='RMSD < 1 & score < -90 & match_probability > 0.75')
+
+Silent outputs of many tasks are merged into minisilent archives made of
+independent gzip members, with an index to extract single decoys (see
+:func:`merge_minisilent` and :func:`extract_decoy`).
+
+Time spent reading is logged at ``DEBUG`` level.
+"""
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+REMARKS = ['DSSP', 'LABELS']
+# Non-coordinate records kept in minisilent files.
+MINISILENT = ('SCORE:', 'REMARK', 'FOLD_TREE', 'ANNOTATED_SEQUENCE:',
+              'NONCANONICAL_CONNECTION:')
+
+_log = logging.getLogger(__name__)
+
+
+def _open(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename)
+
+
+def _query_columns(query):
+    """Names that a query expression may refer to.
+    """
+    if query is None:
+        return set()
+    return set(re.findall(r'[A-Za-z_]\w*', query))
+
+
+def _to_frame(records, columns, remarks):
+    """Build a DataFrame out of parsed decoy records.
+    """
+    data = {}
+    for i, col in enumerate(columns):
+        values = pd.Series([r[0][i] if i < len(r[0]) else None
+                            for r in records], dtype=object)
+        try:
+            data[col] = pd.to_numeric(values)
+        except (ValueError, TypeError):
+            data[col] = values
+    data['description'] = [r[1] for r in records]
+    for i, rmk in enumerate(remarks):
+        data[rmk.lower()] = [r[2][i] for r in records]
+    return pd.DataFrame(data)
+
+
+def iter_silent(filename, columns=None, remarks=None, query=None,
+                chunksize=5000):
+    """Iterate over the decoys of a silent file in chunks.
+
+    :param str filename: Silent file (gzipped or not).
+    :param list columns: Score terms to keep (default: all of them). The
+        ``description`` is always kept.
+    :param list remarks: ``REMARK`` records to keep, as lower case columns
+        (default: ``DSSP`` and ``LABELS``).
+    :param str query: Filter applied to each chunk. Score terms it refers
+        to are read even if not in ``columns``.
+    :param int chunksize: Decoys per chunk (before filtering).
+
+    :return: Iterator of :class:`~pandas.DataFrame`.
+    """
+    remarks = REMARKS if remarks is None else list(remarks)
+    wanted = None if columns is None else list(columns)
+    extra = _query_columns(query)
+    names = [] if wanted is None else [c for c in wanted
+                                       if c != 'description']
+    index = []  # Position of each name in the current header
+    records, current = [], None
+
+    def flush(records):
+        df = _to_frame(records, names, remarks)
+        if query is not None:
+            df = df.query(query)
+        if wanted is not None:
+            df = df[[c for c in df.columns
+                     if c in wanted or c == 'description' or
+                     c in [r.lower() for r in remarks]]]
+        return df
+
+    with _open(filename) as fd:
+        for line in fd:
+            if line.startswith('SCORE:'):
+                fields = line.split()
+                if fields[-1] == 'description':
+                    header = fields[1:-1]
+                    if wanted is None:
+                        for h in header:
+                            if h not in names:
+                                names.append(h)
+                    else:
+                        for h in header:
+                            if h in extra and h not in names:
+                                names.append(h)
+                    index = [header.index(n) + 1 if n in header else None
+                             for n in names]
+                    continue
+                if current is not None:
+                    records.append(current)
+                    if len(records) == chunksize:
+                        yield flush(records)
+                        records = []
+                current = ([fields[i] if i is not None else None
+                            for i in index],
+                           fields[-1], [None] * len(remarks))
+            elif line.startswith('REMARK') and current is not None:
+                fields = line.split(None, 2)
+                if len(fields) == 3 and fields[1] in remarks:
+                    current[2][remarks.index(fields[1])] = fields[2].strip()
+    if current is not None:
+        records.append(current)
+    if len(records) > 0:
+        yield flush(records)
+
+
+def _cache_file(filename):
+    return filename + '.npz'
+
+
+def _stamp(filename):
+    st = os.stat(filename)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def write_cache(filename, chunksize=5000):
+    """Store all score terms and remarks of a silent file in a columnar
+    ``<filename>.npz`` cache next to it.
+    """
+    df = pd.concat(list(iter_silent(filename, chunksize=chunksize)),
+                   ignore_index=True, sort=False)
+    data = {'__stamp__': _stamp(filename)}
+    for col in df.columns:
+        if df[col].dtype.kind in 'biuf':
+            data[col] = df[col].values
+        else:
+            data[col] = np.asarray(df[col].fillna(''), dtype=str)
+    tmp = _cache_file(filename) + '.tmp.npz'
+    np.savez(tmp, **data)
+    os.replace(tmp, _cache_file(filename))
+    return df
+
+
+def read_cache(filename, columns=None, remarks=None, query=None):
+    """Load the requested columns of a silent file from its cache.
+
+    Returns :data:`None` if the cache is missing or stale.
+    """
+    if not os.path.isfile(_cache_file(filename)):
+        return None
+    with np.load(_cache_file(filename)) as data:
+        if not np.array_equal(data['__stamp__'], _stamp(filename)):
+            return None
+        remarks = [r.lower() for r in (REMARKS if remarks is None
+                                       else remarks)]
+        keys = [k for k in data.files if k != '__stamp__']
+        if columns is not None:
+            keep = set(columns) | _query_columns(query) | {'description'}
+            keys = [k for k in keys if k in keep or k in remarks]
+        else:
+            keys = [k for k in keys if k.upper() not in REMARKS or
+                    k in remarks]
+        df = pd.DataFrame({k: data[k] for k in keys})
+    for rmk in remarks:
+        if rmk in df:
+            df[rmk] = df[rmk].astype(object).where(df[rmk] != '', None)
+    if query is not None:
+        df = df.query(query)
+    if columns is not None:
+        df = df[[c for c in df.columns
+                 if c in columns or c == 'description' or c in remarks]]
+    return df
+
+
+def read_silent(filename, columns=None, remarks=None, query=None,
+                chunksize=5000, cache=False):
+    """Read the decoys of a silent file (see :func:`iter_silent`).
+
+    With ``cache``, all data is first stored in a columnar cache next to
+    the silent file (see :func:`write_cache`), so that later calls with
+    other columns or filters do not need to parse the file again.
+    """
+    start = time.perf_counter()
+    if cache:
+        df = read_cache(filename, columns, remarks, query)
+        if df is None:
+            write_cache(filename, chunksize)
+            _log.debug('read_silent %s: cached in %.3f s', filename,
+                       time.perf_counter() - start)
+            start = time.perf_counter()
+            df = read_cache(filename, columns, remarks, query)
+        _log.debug('read_silent %s: %d cached decoys in %.3f s', filename,
+                   len(df), time.perf_counter() - start)
+        return df.reset_index(drop=True)
+    chunks = list(iter_silent(filename, columns, remarks, query, chunksize))
+    df = pd.DataFrame() if len(chunks) == 0 else \
+        pd.concat(chunks, ignore_index=True, sort=False)
+    _log.debug('read_silent %s: %d decoys in %.3f s', filename, len(df),
+               time.perf_counter() - start)
+    return df
+
+
+def minisilent_lines(filename):
+    """Non-coordinate lines of a silent file (see :data:`MINISILENT`).
+    """
+    with _open(filename) as fd:
+        for line in fd:
+            if line.startswith(MINISILENT):
+                yield line
+
+
+def _is_header(line):
+    return line.startswith('SCORE:') and line.split()[-1] == 'description'
+
+
+def _packed_file(filename):
+    return filename + '.mgz'
+
+
+def pack_minisilent(filename, write=False, compresslevel=6):
+    """Compress the minisilent lines of one silent file as a gzip member.
+
+    The leading ``SCORE`` header (and its ``REMARK BINARY SILENTFILE``) is
+    kept apart, so that merged archives only repeat it when it changes.
+    With ``write``, the member is stored in ``<filename>.mgz`` with a
+    ``<filename>.mgz.json`` sidecar (written last) holding the rest, so
+    that each task can pack its output as soon as it is done.
+
+    :return: Header text, member bytes and ``(description, start, end)`` of
+        each decoy in the decompressed member.
+    """
+    header, body, decoys, size = [], [], [], 0
+    for line in minisilent_lines(filename):
+        if len(body) == 0 and (_is_header(line) or (
+                len(header) > 0 and line.startswith('REMARK BINARY'))):
+            header.append(line)
+            continue
+        if line.startswith('SCORE:') and not _is_header(line):
+            if len(decoys) > 0:
+                decoys[-1][2] = size
+            decoys.append([line.split()[-1], size, None])
+        body.append(line)
+        size += len(line.encode())
+    if len(decoys) > 0:
+        decoys[-1][2] = size
+    member = gzip.compress(''.join(body).encode(), compresslevel, mtime=0)
+    header = ''.join(header)
+    if write:
+        packed = _packed_file(filename)
+        with open(packed + '.tmp', 'wb') as fd:
+            fd.write(member)
+        os.replace(packed + '.tmp', packed)
+        with open(packed + '.json.tmp', 'w') as fd:
+            json.dump({'header': header, 'decoys': decoys}, fd)
+        os.replace(packed + '.json.tmp', packed + '.json')
+    return header, member, decoys
+
+
+def _load_packed(filename):
+    """Packed member of a silent file, re-using its ``.mgz`` if up to date.
+    """
+    packed = _packed_file(filename)
+    if os.path.isfile(packed + '.json') and \
+            os.path.getmtime(packed + '.json') >= os.path.getmtime(filename):
+        with open(packed + '.json') as fd:
+            data = json.load(fd)
+        with open(packed, 'rb') as fd:
+            return data['header'], fd.read(), data['decoys']
+    return pack_minisilent(filename)
+
+
+def index_file(archive):
+    return archive + '.idx'
+
+
+def merge_minisilent(sources, outfile, processes=None):
+    """Merge silent files into a gzipped minisilent archive.
+
+    Coordinates are dropped. Each source becomes an independent gzip member
+    (packed in a process pool, unless already packed by
+    :func:`pack_minisilent`) and members are concatenated, which is a valid
+    gzip file. The ``SCORE`` header is only repeated when it changes. The
+    position of each decoy is stored in a ``<outfile>.idx`` table (see
+    :func:`extract_decoy`). The archive is written to a temporary file and
+    renamed when complete.
+
+    :return: Number of decoys.
+    """
+    pool = multiprocessing.Pool(processes) if len(sources) > 1 else None
+    header, offset, rows = None, 0, []
+    tmp = outfile + '.tmp'
+    try:
+        packed = pool.imap(_load_packed, sources) if pool is not None \
+            else map(_load_packed, sources)
+        with open(tmp, 'wb') as out:
+            for head, member, decoys in packed:
+                if len(head) > 0 and head != header:
+                    header = head
+                    head = gzip.compress(head.encode(), mtime=0)
+                    out.write(head)
+                    offset += len(head)
+                out.write(member)
+                for description, start, end in decoys:
+                    rows.append((description, offset, len(member), start,
+                                 end))
+                offset += len(member)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    pd.DataFrame(rows, columns=['description', 'offset', 'size', 'start',
+                                'end']).to_csv(index_file(outfile) + '.tmp',
+                                               sep='\t', index=False)
+    os.replace(tmp, outfile)
+    os.replace(index_file(outfile) + '.tmp', index_file(outfile))
+    return len(rows)
+
+
+def extract_decoy(archive, description, index=None):
+    """Minisilent lines of one decoy, without decompressing the archive.
+
+    :param index: Loaded ``<archive>.idx`` table, to extract many decoys.
+    """
+    if index is None:
+        index = pd.read_csv(index_file(archive), sep='\t')
+    row = index[index['description'] == description]
+    if len(row) == 0:
+        raise KeyError(description)
+    row = row.iloc[0]
+    with open(archive, 'rb') as fd:
+        fd.seek(int(row['offset']))
+        member = gzip.decompress(fd.read(int(row['size'])))
+    return member[int(row['start']):int(row['end'])].decode()
@@ -0,0 +1,75 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import fragments  # noqa: E402
+
+SEQUENCE = 'SCEEAKNYIDKQ'
+SS2 = ['C 0.9 0.05 0.05'] * 4 + ['H 0.1 0.8 0.1'] * 8
+
+
+def frames(size=3, nfrags=4):
+    out = []
+    for start in range(1, len(SEQUENCE) - size + 2):
+        data = np.zeros((nfrags, size), dtype=fragments.FRAGMENT)
+        data['resnum'] = np.arange(nfrags * size).reshape(nfrags, size)
+        data['pdb'], data['kind'] = b'1abc', b'A'
+        data['aa'], data['ss'] = b'L', b'H'
+        data['phi'], data['psi'], data['omega'] = -60., -45., 180.
+        out.append((start, data))
+    return out
+
+
+def write_query(folder):
+    fasta = os.path.join(folder, 'sketch.fa')
+    ss2 = os.path.join(folder, 'structure.ss2')
+    with open(fasta, 'w') as fd:
+        fd.write('>sketch\n{}\n'.format(SEQUENCE))
+    with open(ss2, 'w') as fd:
+        fd.write('# PSIPRED VFORMAT\n\n')
+        for i, (aa, row) in enumerate(zip(SEQUENCE, SS2), 1):
+            fd.write('{:4d} {} {}\n'.format(i, aa, row))
+    return fasta, ss2
+
+
+def test_store_and_assemble(tmpdir):
+    folder = str(tmpdir)
+    fasta, ss2 = write_query(folder)
+    picked = os.path.join(folder, 'frags.4.3mers')
+    fragments.write_fragments(frames(), picked)
+
+    store = fragments.FragmentStore(os.path.join(folder, 'store'))
+    assert store.missing(fasta, ss2, 'vall.gz', 3, 4) == list(range(1, 11))
+    assert store.add_file(picked, fasta, ss2, 'vall.gz') == 10
+    assert store.add_file(picked, fasta, ss2, 'vall.gz') == 0
+    assert len(store) == 10
+
+    out = os.path.join(folder, 'assembled.4.3mers')
+    assert store.assemble(fasta, ss2, 'vall.gz', 3, 4, out) == []
+    with open(picked) as a, open(out) as b:
+        assert a.read() == b.read()
+
+
+def test_concurrent_puts_leave_whole_windows(tmpdir):
+    store = fragments.FragmentStore(str(tmpdir))
+    data = frames()[0][1]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: store.put('ab' * 20, data), range(32)))
+    assert np.array_equal(store.get('ab' * 20), data)
+    leftovers = [f for _, _, files in os.walk(str(tmpdir)) for f in files
+                 if not f.endswith('.npy')]
+    assert leftovers == []
+
+
+def test_sequence_named_like_a_file(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    with open(SEQUENCE, 'w') as fd:
+        fd.write('>other\nAAAAAAAAAAAA\n')
+    fasta, ss2 = write_query(str(tmpdir))
+    keys = fragments.window_keys(SEQUENCE, fragments.read_ss2(ss2),
+                                 'vall.gz', 3, 4)
+    assert keys == fragments.query_keys(fasta, ss2, 'vall.gz', 3, 4)
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import pipeline  # noqa: E402
+import silent  # noqa: E402
+
+
+def decoys(minisilent):
+    return len(pd.read_csv(silent.index_file(minisilent), sep="\t"))
+
+
+def test_merge_after_failed_fold(tmpdir):
+    workdir = str(tmpdir)
+    p = pipeline.design_pipeline(workdir, "test", ntasks=5)
+    p._prepare()
+    # Task 3 cannot write its silent file.
+    os.makedirs(os.path.join(workdir, "out", "test_3"))
+
+    failed = p.run_local(processes=2, stub=True)
+    assert sorted(failed) == [("fold", 3), ("merge", 1)]
+    minisilent = os.path.join(workdir, "bbdesigns.minisilent.gz")
+    assert decoys(minisilent) == 8
+
+    os.rmdir(os.path.join(workdir, "out", "test_3"))
+    assert p.run_local(processes=2, stub=True) == []
+    assert decoys(minisilent) == 10
+
+
+def test_slurm_merge_after_any(tmpdir):
+    workdir = str(tmpdir)
+    submit = pipeline.design_pipeline(workdir, "test", ntasks=5).write_slurm()
+    with open(submit) as fd:
+        lines = [line for line in fd if line.startswith("merge=")]
+    assert "--dependency=afterany:$fragments:$fold " in lines[0]
+    assert subprocess.call(["bash", "-n", submit]) == 0
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic inputs for the benchmarks, scaled from the data bundled with the
+repository.
+
+Each generator writes the inputs of one scale into a folder and returns
+their description (file names and number of items). Outputs only depend
+on the scale and the seed, and a folder that is already complete is
+re-used, so large scales are only generated once.
+
+==================  ================================================  ======
+generator           scale 1                                           items
+==================  ================================================  ======
+:func:`pdbmap`      ``motif_search_complexity/data/pdbmap.gz`` rows   rows
+:func:`master`      100,000 MASTER hits (and their clash scores)      rows
+:func:`structures`  1,000 MASTER match files                          files
+:func:`scores`      1,000 clash score files                           files
+:func:`fastq`       100,000 reads (about 1/5 of a MiSeq sample)       reads
+:func:`silent`      decoys of ``siteIV_bb1_minisilent.gz``            decoys
+==================  ================================================  ======
+"""
+import gzip
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDBMAP = os.path.join(ROOT, 'motif_search_complexity', 'data', 'pdbmap.gz')
+MOTIF = os.path.join(ROOT, 'motif_search_complexity', 'data', '4jhw',
+                     'motif.pdb')
+SILENT = os.path.join(ROOT, 'TopoBuilder', 'S4_2', 'sequence_design',
+                      'siteIV_bb1_design', 'siteIV_bb1_minisilent.gz')
+# S0_2 design enriched for D25 (NGS_analysis notebook) and its anchors.
+DESIGN = 'SCEEAKNYIDKQLLPIVNKAGCGSAEEVQKDIEKALRNAGVKDCLEDILRGIKEIKCG'
+MATCHES = ['KNY', 'KE']
+
+MASTER_HITS = 100000
+MASTER_FILES = 1000
+SCORE_FILES = 1000
+FASTQ_READS = 100000
+MARKER = 'inputs.json'
+
+# Script folders of each analysis, importable as top-level modules.
+SCRIPTS = {'motif': os.path.join(ROOT, 'motif_search_complexity', 'scripts'),
+           'ngs': os.path.join(ROOT, 'NGS_analysis', 'scripts'),
+           'topobuilder': os.path.join(ROOT, 'TopoBuilder', 'scripts')}
+
+
+def use_scripts(project):
+    """Make the scripts of a project importable.
+    """
+    if SCRIPTS[project] not in sys.path:
+        sys.path.insert(0, SCRIPTS[project])
+
+
+def _count(base, scale):
+    return max(1, int(round(base * scale)))
+
+
+def _cached(outdir, name):
+    """Inputs already generated in ``outdir`` for ``name``, if any.
+    """
+    marker = os.path.join(outdir, name + '.' + MARKER)
+    if os.path.isfile(marker):
+        with open(marker) as fd:
+            return json.load(fd)
+    return None
+
+
+def _done(outdir, name, inputs):
+    with open(os.path.join(outdir, name + '.' + MARKER), 'w') as fd:
+        json.dump(inputs, fd)
+    return inputs
+
+
+def _pdbmap_lines():
+    with gzip.open(PDBMAP, 'rt') as fd:
+        return fd.read().splitlines()
+
+
+def _copy_id(pdb, copy):
+    """PDB id of the ``copy``-th replica of an entry (the entry itself for
+    the first one).
+    """
+    return pdb if copy == 0 else '{}{}'.format(pdb, copy)
+
+
+def pdbmap(outdir, scale, seed=0):
+    """PFAM ``pdbmap`` file with ``scale`` times the bundled rows.
+
+    Rows are repeated under new PDB ids, so the number of distinct
+    (pdb, chain) keys grows with the scale.
+    """
+    inputs = _cached(outdir, 'pdbmap')
+    if inputs is not None:
+        return inputs
+    lines = _pdbmap_lines()
+    n = _count(len(lines), scale)
+    filename = os.path.join(outdir, 'pdbmap.gz')
+    with gzip.open(filename + '.tmp', 'wt', compresslevel=1) as fd:
+        written, copy = 0, 0
+        while written < n:
+            block = lines[:n - written]
+            if copy > 0:
+                block = [_copy_id(pdb, copy) + ';' + rest for pdb, rest in
+                         (line.split(';', 1) for line in block)]
+            fd.write('\n'.join(block) + '\n')
+            written += len(block)
+            copy += 1
+    os.replace(filename + '.tmp', filename)
+    return _done(outdir, 'pdbmap', {'pdbmap': filename, 'items': n,
+                                    'copies': copy})
+
+
+def _keys(scale, n, rng):
+    """``n`` random (pdb, chain) pairs of a scaled ``pdbmap``, with about
+    10% of them missing from it.
+    """
+    lines = _pdbmap_lines()
+    keys = sorted(set(tuple(f.strip().lower() if i == 0 else f.strip()
+                            for i, f in enumerate(line.split(';')[:2]))
+                      for line in lines))
+    copies = max(1, int(np.ceil(scale)))
+    pick = rng.integers(0, len(keys), n)
+    copy = rng.integers(0, copies, n)
+    missing = rng.random(n) < 0.1
+    pdbs = np.array(['x{:03d}'.format(k % 1000) if m else
+                     _copy_id(keys[k][0], c)
+                     for k, c, m in zip(pick, copy, missing)])
+    chains = np.array([keys[k][1] for k in pick])
+    return pdbs, chains
+
+
+def _segments(rng, n):
+    """Residue ranges ``(a, b, c, d)`` of ``n`` hits of a two-segment
+    motif (the site 0 loop and helix).
+    """
+    a = rng.integers(0, 150, n)
+    c = a + 8 + rng.integers(5, 120, n)
+    return list(zip(a, a + 7, c, c + 16))
+
+
+def master(outdir, scale, seed=0, epitope='4jhw'):
+    """``data/<epitope>/master_search.csv.gz`` and ``ddg_match.csv.gz``
+    tables as read by ``readme.load_master``, with hits on the PDB chains
+    of a ``pdbmap`` of the same scale.
+    """
+    inputs = _cached(outdir, 'master')
+    if inputs is not None:
+        return inputs
+    rng = np.random.default_rng(seed)
+    n = _count(MASTER_HITS, scale)
+    folder = os.path.join(outdir, 'data', epitope)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    pdbs, chains = _keys(scale, n, rng)
+    clusters = ['{:05d}'.format(c) for c in rng.integers(0, max(1, n // 100),
+                                                          n)]
+    names = ['match{:07d}'.format(i) for i in range(n)]
+    df = pd.DataFrame({'str': names, 'cluster': clusters,
+                       'rmsd': np.round(rng.gamma(4, 0.5, n), 4),
+                       'pdb': pdbs, 'chain': chains,
+                       'range': ['[({}-{})({}-{})]'.format(*r)
+                                 for r in _segments(rng, n)]},
+                      columns=['str', 'cluster', 'rmsd', 'pdb', 'chain',
+                               'range'])
+    df.to_csv(os.path.join(folder, 'master_search.csv.gz'), index=False)
+    ddg = df[rng.random(n) < 0.8]
+    pd.DataFrame({'cluster': ddg['cluster'],
+                  'ddg': np.round(rng.normal(20, 15, len(ddg)), 3),
+                  'str': ddg['str']},
+                 columns=['cluster', 'ddg', 'str']).to_csv(
+        os.path.join(folder, 'ddg_match.csv.gz'), index=False)
+    return _done(outdir, 'master', {'workdir': outdir, 'epitope': epitope,
+                                    'items': n})
+
+
+def structures(outdir, scale, seed=0):
+    """MASTER ``<workfolder>/structures/<cluster>/<match>.pdb`` files, as
+    parsed by ``parse_master.py``.
+    """
+    inputs = _cached(outdir, 'structures')
+    if inputs is not None:
+        return inputs
+    rng = np.random.default_rng(seed)
+    n = _count(MASTER_FILES, scale)
+    root = os.path.join(outdir, 'master', 'structures')
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    with open(MOTIF) as fd:
+        atoms = ''.join(line for line in fd if line.startswith('ATOM'))
+    pdbs, chains = _keys(scale, n, rng)
+    segments = _segments(rng, n)
+    for i in range(n):
+        folder = os.path.join(root, '{:05d}'.format(i // 100))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'match{:07d}.pdb'.format(i)),
+                  'w') as fd:
+            fd.write('REMARK {:.5f} /pds/{}_{}.pds [({},{}), ({},{})]\n'
+                     .format(rng.gamma(4, 0.5), pdbs[i], chains[i],
+                             *segments[i]))
+            fd.write(atoms)
+    return _done(outdir, 'structures', {'workfolder': os.path.dirname(root),
+                                        'items': n})
+
+
+def scores(outdir, scale, seed=0):
+    """Rosetta clash score files ``<workfolder>/scores/<cluster>/*.sc``, as
+    parsed by ``parse_ddg.py``.
+    """
+    inputs = _cached(outdir, 'scores')
+    if inputs is not None:
+        return inputs
+    rng = np.random.default_rng(seed)
+    n = _count(SCORE_FILES, scale)
+    root = os.path.join(outdir, 'ddg', 'scores')
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    terms = ['score', 'fa_atr', 'fa_rep', 'fa_sol', 'fa_elec', 'hbond_sr_bb',
+             'hbond_lr_bb', 'rama_prepro', 'omega', 'p_aa_pp', 'ref',
+             'bb_clash', 'ddg', 'packstat', 'sasa']
+    header = 'SCORE: ' + ' '.join('{:>12}'.format(t) for t in terms) + \
+        ' description\n'
+    for i in range(n):
+        folder = os.path.join(root, '{:05d}'.format(i // 100))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'match{:07d}.sc'.format(i)),
+                  'w') as fd:
+            fd.write('SEQUENCE: \n')
+            fd.write(header)
+            fd.write('SCORE: ' + ' '.join('{:>12.3f}'.format(v) for v in
+                                          rng.normal(0, 50, len(terms))) +
+                     ' match{:07d}_0001\n'.format(i))
+    return _done(outdir, 'scores', {'workfolder': os.path.dirname(root),
+                                    'items': n})
+
+
+def _reverse_translate(protein, codons, rng):
+    return ''.join(codons[aa][rng.integers(len(codons[aa]))]
+                   for aa in protein)
+
+
+def fastq(outdir, scale, seed=0, distinct=0.2):
+    """FASTQ file of yeast display reads of S0_2 design variants.
+
+    A pool of ``distinct`` times the number of reads variants is made by
+    mutating a few positions of :data:`DESIGN` (flanked by the ``AS`` and
+    ``GS`` trimming anchors, in a random frame, some with a stop codon) and
+    reads are drawn from it with heavy-tailed counts, as after selection.
+    """
+    inputs = _cached(outdir, 'fastq')
+    if inputs is not None:
+        return inputs
+    use_scripts('ngs')
+    from fastq import CODON_TABLE
+    codons = {}
+    for codon, aa in sorted(CODON_TABLE.items()):
+        codons.setdefault(aa, []).append(codon)
+    rng = np.random.default_rng(seed)
+    n = _count(FASTQ_READS, scale)
+    amino = 'ACDEFGHIKLMNPQRSTVWY'
+    pool = []
+    for _ in range(max(1, int(n * distinct))):
+        protein = list(DESIGN)
+        for pos in rng.integers(0, len(protein), rng.integers(0, 4)):
+            protein[pos] = amino[rng.integers(len(amino))]
+        dna = _reverse_translate('GAS' + ''.join(protein) + 'GSGL', codons,
+                                 rng)
+        if rng.random() < 0.05:
+            dna = dna[:60] + 'TAA' + dna[63:]
+        pool.append('ACGT'[rng.integers(4)] * rng.integers(0, 3) + dna)
+    weights = rng.pareto(1.5, len(pool)) + 1
+    picks = rng.choice(len(pool), n, p=weights / weights.sum())
+    filename = os.path.join(outdir, 'reads.fastq')
+    with open(filename + '.tmp', 'w') as fd:
+        for i, p in enumerate(picks):
+            seq = pool[p]
+            fd.write('@read{}\n{}\n+\n{}\n'.format(i, seq, 'F' * len(seq)))
+    os.replace(filename + '.tmp', filename)
+    return _done(outdir, 'fastq', {'fastq': filename, 'matches': MATCHES,
+                                   'items': n})
+
+
+def _decoys(filename):
+    """Header and decoy blocks (with their description) of a silent file.
+    """
+    header, decoys, current = [], [], None
+    with gzip.open(filename, 'rt') as fd:
+        for line in fd:
+            if line.startswith('SCORE:'):
+                fields = line.split()
+                if fields[-1] == 'description':
+                    if current is None:
+                        header.append(line)
+                    continue
+                current = [fields[-1], line]
+                decoys.append(current)
+            elif current is None:
+                header.append(line)
+            else:
+                current.append(line)
+    return header, decoys
+
+
+def silent(outdir, scale, seed=0):
+    """Minisilent file with ``scale`` times the decoys of
+    :data:`SILENT`, renamed in each replica.
+    """
+    inputs = _cached(outdir, 'silent')
+    if inputs is not None:
+        return inputs
+    header, decoys = _decoys(SILENT)
+    n = _count(len(decoys), scale)
+    filename = os.path.join(outdir, 'decoys.minisilent.gz')
+    with gzip.open(filename + '.tmp', 'wt', compresslevel=1) as fd:
+        fd.write(''.join(header))
+        written, copy = 0, 0
+        while written < n:
+            for decoy in decoys[:n - written]:
+                name = decoy[0] if copy == 0 else \
+                    '{}_{}'.format(decoy[0], copy)
+                fd.write(''.join(decoy[1:]).replace(decoy[0], name))
+            written += min(len(decoys), n - written)
+            copy += 1
+    os.replace(filename + '.tmp', filename)
+    return _done(outdir, 'silent', {'silent': filename, 'items': n})
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Wall time, peak memory and throughput of the analysis stages over
+synthetic inputs (see :mod:`generators`), compared against stored
+baselines::
+
+    python benchmarks/run.py --scale 1 10            # all stages
+    python benchmarks/run.py parse_pfam --scale 100 --trace
+    python benchmarks/run.py --scale 1 10 --save     # update the baselines
+
+Each stage runs in a fresh interpreter, so its peak RSS is its own (plus
+the interpreter and imports, the same for all runs). Worker pools are
+reported separately, as the peak RSS of the largest worker. With
+``--trace``, the ``DEBUG`` timings logged by the stages are shown as they
+run. The exit status is 1 if any stage is slower or needs more memory
+than its baseline by more than ``--tolerance``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import generators
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines.json')
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# ru_maxrss is in bytes on macOS and in KiB elsewhere.
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def _parse_master(inputs, processes):
+    import collector
+    import parse_master
+    root = os.path.join(inputs['workfolder'], 'structures')
+    outfile = os.path.join(inputs['workfolder'], 'master_search.csv')
+    return lambda: collector.collect(
+        root, parse_master.get_data, parse_master.COLUMNS,
+        parse_master.ERROR, outfile, rebuild=True, processes=processes,
+        progress=None)
+
+
+def _parse_ddg(inputs, processes):
+    import collector
+    import parse_ddg
+    root = os.path.join(inputs['workfolder'], 'scores')
+    outfile = os.path.join(inputs['workfolder'], 'ddg_match.csv')
+    return lambda: collector.collect(
+        root, parse_ddg.get_data, parse_ddg.COLUMNS, parse_ddg.ERROR,
+        outfile, rebuild=True, processes=processes, progress=None)
+
+
+def _load_master(inputs, processes):
+    import readme
+    # load_master reads data/<epitope>/ from the working directory.
+    os.chdir(inputs['workdir'])
+    return lambda: readme.load_master({inputs['epitope']: 1}, cache=False)
+
+
+def _parse_pfam(inputs, processes):
+    import readme
+    return lambda: readme.parse_pfam(inputs['pdbmap'], cache=False)
+
+
+def _pfam2master(inputs, processes):
+    import readme
+    os.chdir(inputs['workdir'])
+    dfs = readme.load_master({inputs['epitope']: 1}, cache=False)
+    pfam = readme.parse_pfam(inputs['pdbmap'], cache=False)
+    return lambda: readme.pfam2master(dfs, pfam)
+
+
+def _count_fastq(inputs, processes):
+    import fastq
+    return lambda: fastq.count_fastq(inputs['fastq'], inputs['matches'],
+                                     processes)
+
+
+def _read_silent(inputs, processes):
+    import silent
+    return lambda: silent.read_silent(inputs['silent'])
+
+
+# Stage -> (scripts, input generators, setup returning the timed call).
+# Throughput is given in items of the first generator.
+STAGES = OrderedDict([
+    ('parse_master', ('motif', [generators.structures], _parse_master)),
+    ('parse_ddg', ('motif', [generators.scores], _parse_ddg)),
+    ('load_master', ('motif', [generators.master], _load_master)),
+    ('parse_pfam', ('motif', [generators.pdbmap], _parse_pfam)),
+    ('pfam2master', ('motif', [generators.master, generators.pdbmap],
+                     _pfam2master)),
+    ('count_fastq', ('ngs', [generators.fastq], _count_fastq)),
+    ('read_silent', ('topobuilder', [generators.silent], _read_silent)),
+])
+
+
+def _peak_rss(children=False):
+    """Peak RSS (MB) of this process or of its largest child.
+
+    On Linux, the peak of this process is read from ``/proc`` because
+    ``ru_maxrss`` keeps the peak of the parent it was forked from.
+    """
+    if not children and os.path.isfile('/proc/self/status'):
+        with open('/proc/self/status') as fd:
+            for line in fd:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    if resource is None:
+        return float('nan')
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss * MAXRSS_UNIT / 2. ** 20
+
+
+def run_child(stage, inputs, processes, trace):
+    """Run a stage in this process and print its measures as JSON.
+    """
+    if trace:
+        import logging
+        logging.basicConfig(
+            level=logging.DEBUG, stream=sys.stderr,
+            format='    %(relativeCreated)9.0f ms %(name)s: %(message)s')
+    project, _, setup = STAGES[stage]
+    generators.use_scripts(project)
+    try:
+        call = setup(inputs, processes)
+    except ImportError as e:
+        print(json.dumps({'error': str(e)}))
+        return
+    start = time.perf_counter()
+    call()
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        'seconds': seconds,
+        'rss_mb': _peak_rss(),
+        'workers_rss_mb': _peak_rss(children=True)}))
+
+
+def measure(stage, scale, outdir, processes=None, repeat=1, trace=False):
+    """Generate the inputs of a stage and time it.
+
+    :return: :class:`dict` of measures: best wall time over ``repeat``
+        runs and the highest peak RSS; ``error`` if the stage cannot run
+        (e.g. missing dependencies).
+    """
+    _, generate, _ = STAGES[stage]
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    inputs = {}
+    for g in reversed(generate):
+        inputs.update(g(outdir, scale))
+    result = {'stage': stage, 'scale': scale, 'items': inputs['items']}
+    for _ in range(repeat):
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', stage,
+               json.dumps(inputs)]
+        if processes is not None:
+            cmd += ['--processes', str(processes)]
+        if trace:
+            cmd.append('--trace')
+        out = subprocess.run(cmd, stdout=subprocess.PIPE,
+                             universal_newlines=True)
+        lines = out.stdout.strip().splitlines()
+        if out.returncode != 0 or len(lines) == 0:
+            result['error'] = 'exit status {}'.format(out.returncode)
+            return result
+        data = json.loads(lines[-1])
+        if 'error' in data:
+            result['error'] = data['error']
+            return result
+        result['seconds'] = min(data['seconds'],
+                                result.get('seconds', float('inf')))
+        for k in ['rss_mb', 'workers_rss_mb']:
+            result[k] = max(data[k], result.get(k, 0))
+    result['items_per_s'] = result['items'] / max(result['seconds'], 1e-9)
+    return result
+
+
+def _key(result):
+    return '{}@{:g}'.format(result['stage'], result['scale'])
+
+
+def load_baselines(filename=BASELINES):
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as fd:
+        return json.load(fd)
+
+
+def save_baselines(results, filename=BASELINES):
+    """Store (or update) the baselines of successful measures.
+    """
+    baselines = load_baselines(filename)
+    for r in results:
+        if 'error' not in r:
+            baselines[_key(r)] = {
+                k: r[k] for k in ['items', 'seconds', 'items_per_s',
+                                  'rss_mb', 'workers_rss_mb']}
+            baselines[_key(r)]['machine'] = '{} ({} cores)'.format(
+                platform.node(), os.cpu_count())
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fd:
+        json.dump(baselines, fd, indent=2, sort_keys=True)
+        fd.write('\n')
+    os.replace(tmp, filename)
+
+
+def compare(result, baselines, tolerance):
+    """Relative change of time and memory against the baseline.
+
+    :return: Description of the change and whether it is a regression.
+    """
+    base = baselines.get(_key(result))
+    if base is None or 'error' in result:
+        return '', False
+    if base['items'] != result['items']:
+        return 'baseline has {} items'.format(base['items']), False
+    time_change = result['seconds'] / base['seconds'] - 1
+    rss_change = result['rss_mb'] / base['rss_mb'] - 1
+    slower = time_change > tolerance or rss_change > tolerance
+    return '{:+.0%} time, {:+.0%} RSS{}'.format(
+        time_change, rss_change, '  REGRESSION' if slower else ''), slower
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the analysis stages over synthetic inputs.')
+    parser.add_argument('stages', nargs='*',
+                        help='stages to run (default: all of {})'.format(
+                            ', '.join(STAGES)))
+    parser.add_argument('-s', '--scale', type=float, nargs='+', default=[1],
+                        help='input sizes, relative to the bundled data '
+                        '(default: %(default)s)')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='runs per stage; the fastest is kept '
+                        '(default: %(default)s)')
+    parser.add_argument('-d', '--data', default=DATA,
+                        help='folder for the generated inputs '
+                        '(default: %(default)s)')
+    parser.add_argument('-b', '--baselines', default=BASELINES,
+                        help='baselines file (default: %(default)s)')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='allowed relative increase of time and memory '
+                        '(default: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baselines')
+    parser.add_argument('--trace', action='store_true',
+                        help='show the timings logged inside each stage')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child is not None:
+        run_child(options.child[0], json.loads(options.child[1]),
+                  options.processes, options.trace)
+        return 0
+
+    unknown = [s for s in options.stages if s not in STAGES]
+    if unknown:
+        parser.error('unknown stages: {}'.format(', '.join(unknown)))
+
+    baselines = load_baselines(options.baselines)
+    results, regressions = [], 0
+    row = '{:<13} {:>7} {:>10} {:>9} {:>12} {:>8} {:>8}  {}'
+    print(row.format('stage', 'scale', 'items', 'seconds', 'items/s',
+                     'RSS MB', 'workers', 'vs baseline'))
+    for scale in options.scale:
+        outdir = os.path.join(options.data, 'scale_{:g}'.format(scale))
+        for stage in options.stages or STAGES:
+            r = measure(stage, scale, outdir, options.processes,
+                        options.repeat, options.trace)
+            results.append(r)
+            if 'error' in r:
+                print(row.format(stage, '{:g}'.format(scale), r['items'],
+                                 '-', '-', '-', '-',
+                                 'skipped: {}'.format(r['error'])))
+                continue
+            change, slower = compare(r, baselines, options.tolerance)
+            regressions += slower
+            print(row.format(stage, '{:g}'.format(scale), r['items'],
+                             '{:.3f}'.format(r['seconds']),
+                             '{:.0f}'.format(r['items_per_s']),
+                             '{:.0f}'.format(r['rss_mb']),
+                             '{:.0f}'.format(r['workers_rss_mb']), change))
+            sys.stdout.flush()
+    if options.save:
+        save_baselines(results, options.baselines)
+    return 1 if regressions > 0 and not options.save else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Shared machinery of the ``parse_master.py`` and ``parse_ddg.py`` collectors.
+
+Each collected file (``<workfolder>/<subfolder>/<cluster>/<file>``) yields
+exactly one row. Rows are kept, together with the ``path``, ``size`` and
+``mtime`` of the file they come from, in a manifest next to the output
+table. Later runs only parse files that are new or changed since the
+manifest was written, so re-running over an unchanged tree costs a
+single directory scan. The manifest is a plain CSV file that rows are
+appended to as they are parsed; the partial row left by an interrupted
+run is dropped when it is read again, and an output table older than the
+manifest is regenerated even if there is nothing new to parse.
+
+Time spent in each step is logged at ``DEBUG`` level (e.g. enable it with
+``logging.basicConfig(level=logging.DEBUG)``).
+"""
+import functools
+import gzip
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import pandas as pd
+
+STAT = ["path", "size", "mtime"]
+MAX_REPORTED_ERRORS = 10
+
+_log = logging.getLogger(__name__)
+
+
+def scan_tree(root):
+    """List all ``<root>/*/*`` files with their size and mtime (ns).
+    """
+    paths, sizes, mtimes = [], [], []
+    with os.scandir(root) as clusters:
+        for cluster in clusters:
+            if not cluster.is_dir():
+                continue
+            with os.scandir(cluster.path) as entries:
+                for entry in entries:
+                    st = entry.stat()
+                    paths.append(entry.path)
+                    sizes.append(st.st_size)
+                    mtimes.append(st.st_mtime_ns)
+    return pd.DataFrame({"path": paths, "size": sizes, "mtime": mtimes})
+
+
+def manifest_file(outfile):
+    return outfile + ".manifest"
+
+
+def read_manifest(filename, columns):
+    """Load a manifest, or an empty one if there is none.
+
+    Anything after the last complete row (an append cut short by an
+    interrupted run) is truncated from the file, so later appends start
+    on a new row.
+    """
+    if not os.path.isfile(filename):
+        return pd.DataFrame(columns=STAT + columns)
+    with open(filename, "rb+") as fd:
+        data = fd.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            fd.truncate(end)
+    if end == 0:
+        # Not even the header made it.
+        os.remove(filename)
+        return pd.DataFrame(columns=STAT + columns)
+    df = pd.read_csv(io.BytesIO(data[:end]), dtype=str,
+                     keep_default_na=False)
+    df["size"] = df["size"].astype("int64")
+    df["mtime"] = df["mtime"].astype("int64")
+    return df
+
+
+def _up_to_date(outfile, mfile):
+    """Whether ``outfile`` was written after the last manifest change, i.e.
+    the run that last changed the manifest was not interrupted before
+    regenerating it.
+    """
+    if not os.path.isfile(outfile) or not os.path.isfile(mfile):
+        return False
+    return os.stat(outfile).st_mtime_ns >= os.stat(mfile).st_mtime_ns
+
+
+def _tagged(parse, error, entry):
+    """Parse one file, returning its manifest row and the error, if any.
+    """
+    try:
+        row = parse(entry[0])
+    except (OSError, ValueError, IndexError, UnicodeDecodeError) as e:
+        return list(entry) + list(error), "{}: {}".format(entry[0], e)
+    if list(row) == list(error):
+        return list(entry) + list(row), "{}: unparsable".format(entry[0])
+    return list(entry) + list(row), None
+
+
+def collect(root, parse, columns, error, outfile, rebuild=False,
+            processes=None, chunksize=10000, progress=sys.stderr):
+    """Collect one row per file under ``root`` into ``outfile``.
+
+    :param str root: Folder holding ``<cluster>/<file>`` entries.
+    :param parse: Picklable function turning a file name into a row.
+    :param list columns: Names of the row fields.
+    :param list error: Row stored for files that cannot be parsed.
+    :param str outfile: Output table (gzip-compressed if it ends in ``.gz``).
+    :param bool rebuild: Ignore the manifest and parse every file.
+    :param int processes: Worker processes (default: all cores).
+    :param int chunksize: Rows parsed between manifest writes.
+    :param progress: Stream for aggregated progress reports (and the first
+        :data:`MAX_REPORTED_ERRORS` errors).
+
+    :return: Number of parsed files, number of errors and total rows.
+    """
+    mfile = manifest_file(outfile)
+    start = time.perf_counter()
+    scanned = scan_tree(root)
+    _log.debug("collect: scanned %d files in %.3f s", len(scanned),
+               time.perf_counter() - start)
+    known = (pd.DataFrame(columns=STAT + columns) if rebuild
+             else read_manifest(mfile, columns))
+
+    keep = known.merge(scanned, on=STAT, how="inner")
+    todo = scanned[~scanned["path"].isin(keep["path"])]
+    stale = len(known) - len(keep)
+    if len(todo) == 0 and stale == 0 and _up_to_date(outfile, mfile):
+        return 0, 0, len(keep)
+
+    # Drop rows of changed or deleted files.
+    if stale > 0 or len(known) == 0:
+        tmp = mfile + ".tmp"
+        keep.to_csv(tmp, index=False)
+        os.replace(tmp, mfile)
+
+    nparsed, nerrors = 0, 0
+    entries = list(todo.itertuples(index=False, name=None))
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(processes)
+    try:
+        rows = pool.imap_unordered(functools.partial(_tagged, parse, error),
+                                   entries,
+                                   chunksize=max(1, min(256, chunksize)))
+        chunk = []
+        for row, failed in rows:
+            chunk.append(row)
+            if failed is not None:
+                nerrors += 1
+                if progress is not None and nerrors <= MAX_REPORTED_ERRORS:
+                    progress.write("error: {}\n".format(failed))
+            if len(chunk) == chunksize or nparsed + len(chunk) == len(entries):
+                with open(mfile, "a") as fd:
+                    fd.write(pd.DataFrame(chunk, columns=STAT + columns)
+                             .to_csv(index=False, header=False))
+                nparsed += len(chunk)
+                chunk = []
+                if progress is not None:
+                    progress.write("{}/{} files, {} errors\n".format(
+                        nparsed, len(entries), nerrors))
+                    progress.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+    _log.debug("collect: parsed %d files (%d errors) in %.3f s", nparsed,
+               nerrors, time.perf_counter() - start)
+
+    # Regenerate the output table from the manifest, chunk by chunk.
+    start = time.perf_counter()
+    nrows = 0
+    tmp = outfile + ".tmp"
+    opener = gzip.open if outfile.endswith(".gz") else open
+    with opener(tmp, "wt") as fd:
+        for df in pd.read_csv(mfile, dtype=str, keep_default_na=False,
+                              chunksize=max(chunksize, 1)):
+            df[columns].to_csv(fd, index=False, header=nrows == 0)
+            nrows += len(df)
+        if nrows == 0:
+            pd.DataFrame(columns=columns).to_csv(fd, index=False)
+    os.replace(tmp, outfile)
+    _log.debug("collect: wrote %d rows in %.3f s", nrows,
+               time.perf_counter() - start)
+    return nparsed, nerrors, nrows
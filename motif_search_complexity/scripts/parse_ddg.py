@@ -1,42 +1,71 @@
-import pandas as pd
-import glob
+import argparse
 import sys
 import os
 
+try:
+    from . import collector
+except ImportError:
+    import collector
+
+COLUMNS = ["cluster", "ddg", "str"]
+ERROR = ["e", 100000, "eeee"]
+
+def read_scores( filename, columns ):
+    """Iterate over the decoys of a Rosetta score file.
+
+    The header is read once to find the position of ``columns``; each data
+    line is then split a single time. Yields the (float) values of the
+    requested columns followed by the decoy description. Headerless files
+    fall back to the third field, as the collector always did.
+    """
+    index = None
+    with open(filename) as fd:
+        for line in fd:
+            if line.startswith("SEQUENCE"):
+                continue
+            l = line.split()
+            if len(l) == 0:
+                continue
+            if l[0] == "SCORE:" and l[-1] == "description":
+                try:
+                    index = [l.index(c) for c in columns]
+                except ValueError:
+                    raise ValueError("missing score column(s) {}".format(
+                        [c for c in columns if c not in l]))
+                continue
+            if index is None:
+                index = [2, ] * len(columns)
+            yield [float(l[i]) for i in index] + [l[-1], ]
+
 def get_data( filename ):
-    try:
-        with open(filename) as fd:
-            header = 0
-            for line in fd:
-                if line.startswith("SEQUENCE"):continue
-                if line.startswith("SCORE: total_score"):
-                    l = line.split();
-                    for i, ii in enumerate(l):
-                        if ii == "bb_clash":
-                            header = i
-                            break
-                    continue
-                if header == 0: header = 2
-                l = line.strip().split();
-                return [
-                    group,
-                    float(l[header]),
-                    l[-1].split("_")[0]
-                ]
-    except KeyboardInterrupt:
-        sys.exit()
-    except:
-        return ["e",100000,"eeee"]
+    for scores in read_scores(filename, ["bb_clash"]):
+        return [
+            os.path.split(os.path.split(filename)[0])[-1],
+            scores[0],
+            scores[-1].split("_")[0]
+        ]
+    raise ValueError("no decoy found")
 
 if __name__ == '__main__':
-    workfolder = sys.argv[1]
-    files = glob.glob(os.path.join(workfolder,"ddgout","*","*"))
-    sys.stdout.write("listed {} files\n".format(len(files)))
-    data = {}
-    for f in files:
-        d = get_data(f)
-        data.setdefault("cluster", []).append(d[0])
-        data.setdefault("ddg", []).append(d[1])
-        data.setdefault("str", []).append(d[2])
-    df = pd.DataFrame(data)
-    df.to_csv(os.path.join(workfolder,"ddg_match.csv"), index=False)
+    parser = argparse.ArgumentParser(
+        description="Collect binder clash scores into a single table.")
+    parser.add_argument("workfolder")
+    parser.add_argument("-o", "--output", default="ddg_match.csv",
+                        help="output file name inside workfolder; '.gz' "
+                        "compresses it (default: %(default)s)")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("-c", "--chunksize", type=int, default=10000,
+                        help="rows per written chunk (default: %(default)s)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="ignore the manifest of a previous run and "
+                        "parse all files")
+    options = parser.parse_args()
+
+    workfolder = options.workfolder
+    nparsed, nerrors, nrows = collector.collect(
+        os.path.join(workfolder, "ddgout"), get_data, COLUMNS, ERROR,
+        os.path.join(workfolder, options.output), options.rebuild,
+        options.processes, options.chunksize)
+    sys.stdout.write("parsed {} new files ({} errors), {} rows in total\n"
+                     .format(nparsed, nerrors, nrows))
@@ -1,10 +1,18 @@
-import pandas as pd
-import glob
+import argparse
 import sys
 import os
 
+try:
+    from . import collector
+except ImportError:
+    import collector
+
+COLUMNS = ["str", "cluster", "rmsd", "pdb", "chain", "range"]
+ERROR = ["error", "e", 0.0, "eeee", "e", "none"]
+
 def get_data( filename ):
-    line = open(filename).readline().replace(", ","").strip().split()
+    with open(filename) as fd:
+        line = fd.readline().replace(", ","").strip().split()
     if len(line) == 4:
         pdb  = os.path.split(line[2])[-1].split(".")[0].split("_")
         return [
@@ -13,24 +21,28 @@ def get_data( filename ):
             line[1], pdb[0], pdb[1], line[-1].replace(",","-")
         ]
     else:
-        return ["error","e",0.0,"eeee","e","none"]
+        return list(ERROR)
 
 if __name__ == '__main__':
-    workfolder = sys.argv[1]
-    files = glob.glob(os.path.join(workfolder,"structures","*","*"))
-    sys.stdout.write("listed {} files\n".format(len(files)))
-    data = {"str":[], "cluster":[], "rmsd":[], "pdb":[], "chain":[],"range":[]}
-    for f in files:
-        sys.stdout.write(f+"\n")
-        d = get_data(f)
-        if d[1] == "e":
-            sys.stdout.write("error\n")
-        sys.stdout.flush()
-        data["str"].append(d[0])
-        data["cluster"].append(d[1])
-        data["rmsd"].append(d[2])
-        data["pdb"].append(d[3])
-        data["chain"].append(d[4])
-        data["range"].append(d[5])
-    df = pd.DataFrame(data).sort_values(["rmsd"])
-    df.to_csv(os.path.join(workfolder, "master_search.csv"), index=False )
+    parser = argparse.ArgumentParser(
+        description="Collect MASTER matches into a single table.")
+    parser.add_argument("workfolder")
+    parser.add_argument("-o", "--output", default="master_search.csv",
+                        help="output file name inside workfolder; '.gz' "
+                        "compresses it (default: %(default)s)")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("-c", "--chunksize", type=int, default=10000,
+                        help="rows per written chunk (default: %(default)s)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="ignore the manifest of a previous run and "
+                        "parse all files")
+    options = parser.parse_args()
+
+    workfolder = options.workfolder
+    nparsed, nerrors, nrows = collector.collect(
+        os.path.join(workfolder, "structures"), get_data, COLUMNS, ERROR,
+        os.path.join(workfolder, options.output), options.rebuild,
+        options.processes, options.chunksize)
+    sys.stdout.write("parsed {} new files ({} errors), {} rows in total\n"
+                     .format(nparsed, nerrors, nrows))
@@ -7,7 +7,13 @@
     Bruno Correia <bruno.correia@epfl.ch>
 """
 import gzip
+import hashlib
+import io
+import logging
 import os
+import shutil
+import time
+import weakref
 
 import pandas as pd
 import numpy as np
@@ -17,72 +23,603 @@ import seaborn as sns
 import rstoolbox
 
 
-def load_master(dfs):
+CACHE_VERSION = 3
+
+# Time spent loading and joining data is logged at DEBUG level.
+_log = logging.getLogger(__name__)
+
+
+def _file_stamp(f):
+    """Size and modification time (ns) identifying a file's state.
+    """
+    st = os.stat(f)
+    return np.array([CACHE_VERSION, st.st_size, st.st_mtime_ns],
+                    dtype=np.int64)
+
+
+def _file_hash(f):
+    """SHA1 of a file's content.
+    """
+    sha = hashlib.sha1()
+    with open(f, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _cache_is_valid(stamp, sha1, sources):
+    """Check the stamp (and hashes, if needed) stored with a cache.
+    """
+    stamp = np.asarray(stamp)
+    if np.array_equal(stamp, np.concatenate([_file_stamp(f)
+                                             for f in sources])):
+        return True
+    return (len(stamp) == 3 * len(sources) and
+            bool(np.all(stamp[0::3] == CACHE_VERSION)) and
+            str(sha1) == ",".join([_file_hash(f) for f in sources]))
+
+
+def _frame_to_cache(df, sources, folder):
+    """Store a DataFrame as one ``.npy`` file per column (and categories).
+
+    String columns are stored as their UTF-8 text, one value per line.
+    """
+    tmp = folder + ".tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "stamp.npy"),
+            np.concatenate([_file_stamp(f) for f in sources]))
+    np.save(os.path.join(tmp, "sha1.npy"),
+            np.array(",".join([_file_hash(f) for f in sources])))
+    np.save(os.path.join(tmp, "columns.npy"),
+            np.asarray(df.columns, dtype=str))
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, col + ".codes.npy"),
+                    df[col].cat.codes.values)
+            np.save(os.path.join(tmp, col + ".categories.npy"),
+                    np.asarray(df[col].cat.categories, dtype=str))
+        elif df[col].dtype.kind in "biuf":
+            np.save(os.path.join(tmp, col + ".npy"), df[col].values)
+        else:
+            text = "".join([v + "\n" for v in df[col].fillna("").astype(str)])
+            np.save(os.path.join(tmp, col + ".text.npy"),
+                    np.frombuffer(text.encode("utf-8"), dtype=np.uint8))
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.rename(tmp, folder)
+
+
+def _frame_from_cache(sources, folder, mmap=False):
+    """Load a DataFrame stored by :func:`_frame_to_cache`.
+
+    Returns :data:`None` if there is no valid cache for the current state
+    of the ``sources``. With ``mmap``, numeric columns and category codes
+    are memory-mapped instead of read (string columns are always read).
+    """
+    if not os.path.isfile(os.path.join(folder, "columns.npy")):
+        return None
+    if not _cache_is_valid(np.load(os.path.join(folder, "stamp.npy")),
+                           np.load(os.path.join(folder, "sha1.npy")),
+                           sources):
+        return None
+    mode = "r" if mmap else None
+    data = {}
+    for col in np.load(os.path.join(folder, "columns.npy")):
+        col = str(col)
+        if os.path.isfile(os.path.join(folder, col + ".codes.npy")):
+            data[col] = pd.Categorical.from_codes(
+                np.load(os.path.join(folder, col + ".codes.npy"),
+                        mmap_mode=mode),
+                np.load(os.path.join(folder, col + ".categories.npy")))
+        elif os.path.isfile(os.path.join(folder, col + ".text.npy")):
+            text = np.load(os.path.join(folder, col + ".text.npy"))
+            data[col] = np.array(
+                text.tobytes().decode("utf-8").split("\n")[:-1],
+                dtype=object)
+        else:
+            data[col] = np.load(os.path.join(folder, col + ".npy"),
+                                mmap_mode=mode)
+    return pd.DataFrame(data, copy=False)
+
+
+# Only low-cardinality keys are categorical; match names and ranges are
+# (nearly) unique per row.
+MASTER_DTYPES = {"str": str, "cluster": "category", "rmsd": np.float32,
+                 "pdb": "category", "chain": "category", "range": str}
+DDG_DTYPES = {"cluster": str, "ddg": np.float32, "str": str}
+
+
+def _read_master(master, ddg=None):
+    """Read a master search (and its clash data) into a compact DataFrame.
+
+    Keys are categorical, scores are :class:`numpy.float32` and the
+    span of each motif range is pre-parsed into ``range_ini`` and
+    ``range_end`` (see :func:`range_bounds`). Clash data is joined over
+    integer keys of ``cluster`` and ``str`` (see :func:`_category_keys`).
+    """
+    start = time.perf_counter()
+    df = pd.read_csv(master, dtype=MASTER_DTYPES)
+    _log.debug("read %s: %d rows in %.3f s", master, len(df),
+               time.perf_counter() - start)
+    start = time.perf_counter()
+    df["range_ini"], df["range_end"] = range_bounds(df["range"])
+    _log.debug("range_bounds: %d ranges in %.3f s", len(df),
+               time.perf_counter() - start)
+    if ddg is not None:
+        start = time.perf_counter()
+        tmp = pd.read_csv(ddg, dtype=DDG_DTYPES)
+        _log.debug("read %s: %d rows in %.3f s", ddg, len(tmp),
+                   time.perf_counter() - start)
+        start = time.perf_counter()
+        left, right = _join_index(
+            _category_keys(df, df, ["cluster", "str"]),
+            _category_keys(tmp, df, ["cluster", "str"]))
+        df = df.iloc[left].reset_index(drop=True)
+        df["ddg"] = _take(tmp["ddg"], right)
+        _log.debug("ddg join: %d rows in %.3f s", len(df),
+                   time.perf_counter() - start)
+    return df
+
+
+def load_master(dfs, cache=True, mmap=False):
     """Load the master search processed data.
+
+    Data is kept in a compact layout (see :func:`_read_master`). With
+    ``cache``, the loaded DataFrame is also stored column by column in
+    ``data/<k>/master_search.cache``, which is re-generated whenever the
+    source files change and can be memory-mapped with ``mmap``.
     """
     for k in dfs:
         if not isinstance(dfs[k], int):
             continue
-        dfs[k] = pd.read_csv(os.path.join("data", k, "master_search.csv.gz"))
-        if os.path.isfile(os.path.join("data", k, "ddg_match.csv.gz")):
-            tmp = pd.read_csv(os.path.join("data", k, "ddg_match.csv.gz"))
-            dfs[k] = dfs[k].merge(tmp, how="left", on=["cluster", "str"])
+        master = os.path.join("data", k, "master_search.csv.gz")
+        ddg = os.path.join("data", k, "ddg_match.csv.gz")
+        ddg = ddg if os.path.isfile(ddg) else None
+        sources = [f for f in [master, ddg] if f is not None]
+        folder = os.path.join("data", k, "master_search.cache")
+        start = time.perf_counter()
+        df = _frame_from_cache(sources, folder, mmap) if cache else None
+        if df is not None:
+            _log.debug("load_master %s: %d cached rows in %.3f s", k,
+                       len(df), time.perf_counter() - start)
+        else:
+            df = _read_master(master, ddg)
+            if cache:
+                start = time.perf_counter()
+                try:
+                    _frame_to_cache(df, sources, folder)
+                    if mmap:
+                        df = _frame_from_cache(sources, folder, mmap)
+                except OSError:
+                    pass
+                _log.debug("load_master %s: cached in %.3f s", k,
+                           time.perf_counter() - start)
+        dfs[k] = df
     return dfs
 
 
-def parse_pfam(f):
-    """Read and process the PFAM file
+def _read_pfam(f):
+    """Parse the raw gzipped PFAM ``pdbmap`` file into a DataFrame.
     """
-    def pfam_length(pfam_range):
-        r = [int(x) for x in pfam_range.split("-")]
-        return r[1] - r[0] + 1
-    data = {"pdb": [], "chain": [], "pfamrange": [], "pfam": []}
     with gzip.open(f, 'rt') as fd:
-        for line in fd:
-            ln = [x.strip() for x in line.strip().split(";")]
-            data["pdb"].append(ln[0].lower())
-            data["chain"].append(ln[1])
-            data["pfamrange"].append(ln[-2])
-            data["pfam"].append(ln[3])
-
-    df = pd.DataFrame(data)
-    df["length"] = df.apply(lambda row: pfam_length(row["pfamrange"]), axis=1)
+        text = fd.read().replace("\t", "")
+    raw = pd.read_csv(io.StringIO(text), sep=";", header=None,
+                      names=range(8), dtype=str, na_filter=False)
+    # Some entries carry an extra residue-range field; PFAM range is always
+    # the last non-empty field.
+    pfamrange = raw[6].where(raw[6] != "", raw[5])
+    df = pd.DataFrame({"pdb": raw[0].str.lower(), "chain": raw[1],
+                       "pfamrange": pfamrange, "pfam": raw[3]})
+    for col in df.columns:
+        df[col] = df[col].astype("category")
+    return df
+
+
+def _pfam_to_cache(df, f, cache):
+    """Store a parsed PFAM DataFrame as a columnar ``.npz`` file.
+    """
+    data = {"stamp": _file_stamp(f), "sha1": np.array(_file_hash(f))}
+    for col in ["pdb", "chain", "pfamrange", "pfam"]:
+        data[col + "_codes"] = df[col].cat.codes.values
+        data[col + "_categories"] = np.asarray(df[col].cat.categories,
+                                              dtype=str)
+    tmp = cache + ".tmp.npz"
+    np.savez(tmp, **data)
+    os.replace(tmp, cache)
+
+
+def _pfam_from_cache(f, cache):
+    """Load a parsed PFAM DataFrame from its ``.npz`` cache.
+
+    Returns :data:`None` if there is no valid cache for the current state
+    of the source file.
+    """
+    if not os.path.isfile(cache):
+        return None
+    with np.load(cache) as data:
+        if not _cache_is_valid(data["stamp"], data["sha1"], [f]):
+            return None
+        return pd.DataFrame({
+            col: pd.Categorical.from_codes(data[col + "_codes"],
+                                           data[col + "_categories"])
+            for col in ["pdb", "chain", "pfamrange", "pfam"]})
+
+
+def parse_pfam(f, cache=True):
+    """Read and process the PFAM file
+
+    The parsed data is stored in a ``<f>.npz`` cache next to the source
+    file, which is rebuilt whenever the content of the source changes.
+    Rows are sorted by ``pdb`` and ``chain`` (both categorical), which
+    lets :func:`pfam2master` join by category codes.
+    """
+    cache_file = f + ".npz"
+    start = time.perf_counter()
+    df = _pfam_from_cache(f, cache_file) if cache else None
+    if df is not None:
+        _log.debug("parse_pfam: %d cached rows in %.3f s", len(df),
+                   time.perf_counter() - start)
+    else:
+        df = _read_pfam(f)
+        _log.debug("parse_pfam: read %d rows in %.3f s", len(df),
+                   time.perf_counter() - start)
+        start = time.perf_counter()
+        keys = _category_keys(df, df, ["pdb", "chain"])
+        df = df.iloc[np.argsort(keys, kind="stable")].reset_index(drop=True)
+        _log.debug("parse_pfam: sorted in %.3f s", time.perf_counter() - start)
+        if cache:
+            start = time.perf_counter()
+            try:
+                _pfam_to_cache(df, f, cache_file)
+            except OSError:
+                pass
+            _log.debug("parse_pfam: cached in %.3f s",
+                       time.perf_counter() - start)
+
+    bounds = range_segments(df["pfamrange"].cat.categories)
+    length = np.zeros(len(df["pfamrange"].cat.categories), dtype=np.int64)
+    length[bounds["row"].values] = (bounds["end"] - bounds["ini"] + 1).values
+    df["length"] = length[df["pfamrange"].cat.codes.values]
+    return df
+
+
+def _category_keys(df, reference, on):
+    """Integer keys of the ``on`` columns of ``df``.
+
+    Keys are built over the categories (or distinct values, for
+    non-categorical columns) of the same columns in ``reference``; rows
+    with values unknown to ``reference`` get ``-1``.
+    """
+    keys = np.zeros(len(df), dtype=np.int64)
+    unknown = np.zeros(len(df), dtype=bool)
+    for col in on:
+        if isinstance(reference[col].dtype, pd.CategoricalDtype):
+            categories = reference[col].cat.categories
+        else:
+            categories = pd.Index(pd.unique(reference[col].values))
+        codes = categories.get_indexer(df[col].values)
+        keys = keys * len(categories) + codes
+        unknown |= codes < 0
+    keys[unknown] = -1
+    return keys
+
+
+def _join_index(keys, other_keys):
+    """Row indexers of a left join over integer keys.
+
+    Keys equal to ``-1`` never match. Rows of ``df`` without a match get
+    a right indexer of ``-1``. Matches keep the order of both sides, as
+    in :meth:`pandas.DataFrame.merge`.
+    """
+    order = np.argsort(other_keys, kind="stable")
+    other_keys = other_keys[order]
+    lo = np.searchsorted(other_keys, keys, side="left")
+    hi = np.searchsorted(other_keys, keys, side="right")
+    found = (hi - lo) * (keys >= 0)
+    reps = np.maximum(found, 1)
+    left = np.repeat(np.arange(len(keys)), reps)
+    right = (np.repeat(lo, reps) + np.arange(len(left)) -
+             np.repeat(np.cumsum(reps) - reps, reps))
+    missing = np.repeat(found == 0, reps)
+    right = np.where(missing, -1, order[np.where(missing, 0, right)])
+    return left, right
+
+
+def _take(values, index):
+    """Take rows of a column, with missing values where ``index`` is -1.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = np.where(index < 0, -1, values.cat.codes.values[index])
+        return pd.Categorical.from_codes(codes, values.cat.categories)
+    values = values.values[index]
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(float)
+    return np.where(index < 0, np.nan, values).astype(values.dtype)
+
+
+def _pfam_merge(df, pfam):
+    """Left-join ``pfam`` onto ``df`` over (pdb, chain).
+
+    Equivalent to ``df.merge(pfam, how="left", on=["pdb", "chain"])`` for
+    a PFAM DataFrame as returned by :func:`parse_pfam`, but matches are
+    found by binary search over its category codes.
+    """
+    left, right = _join_index(_category_keys(df, pfam, ["pdb", "chain"]),
+                              _category_keys(pfam, pfam, ["pdb", "chain"]))
+    df = df.iloc[left].reset_index(drop=True)
+    for col in pfam.columns.drop(["pdb", "chain"]):
+        df[col] = _take(pfam[col], right)
     return df
 
 
+_DIGITS = bytes(c if c in b"0123456789;" else 32 for c in range(256))
+
+
+def range_segments(ranges):
+    """Parse ranges (``[(a-b)(c-d)]`` or ``a-b``) into integer bounds.
+
+    All ranges are tokenized together in a single pass. Returns a
+    :class:`~pandas.DataFrame` with one row per segment and columns
+    ``row`` (position of the source row), ``ini`` and ``end``. Rows
+    without a well-formed range (missing PFAM data, error assignments)
+    simply produce no segments.
+    """
+    text = (";".join([str(x) for x in ranges]) + ";").encode()
+    text = text.translate(_DIGITS).replace(b";", b" -1 ")
+    values = np.fromstring(text.decode(), dtype=np.int64, sep=" ")
+    sep = values < 0
+    row = (np.cumsum(sep) - sep)[~sep]
+    values = values[~sep]
+    odd = np.bincount(row, minlength=len(ranges)) % 2 == 1
+    row, values = row[~odd[row]], values[~odd[row]]
+    return pd.DataFrame({"row": row[0::2],
+                         "ini": values[0::2],
+                         "end": values[1::2]})
+
+
+def fit_in_range(motif_range, pfam_range):
+    """As a single protein can have multiple PFAM domains,
+    this function evaluates if the motif match falls
+    inside the assigned PFAM domain.
+
+    Works over whole columns at once: range strings are parsed once into
+    integer bounds and the check over all the segments of each motif is
+    reduced with :func:`numpy.bincount`.
+    """
+    nrows = len(motif_range)
+    pfam = range_segments(pfam_range)
+    pfam = pfam[np.bincount(pfam["row"], minlength=nrows)[pfam["row"]] == 1]
+    pini = np.full(nrows, np.nan)
+    pend = np.full(nrows, np.nan)
+    pini[pfam["row"].values] = pfam["ini"].values
+    pend[pfam["row"].values] = pfam["end"].values
+
+    seg = range_segments(motif_range)
+    row = seg["row"].values
+    ok = (seg["ini"].values >= pini[row]) & (seg["end"].values <= pend[row])
+    nseg = np.bincount(row, minlength=nrows)
+    nok = np.bincount(row, weights=ok, minlength=nrows)
+    return (nseg > 0) & (nok == nseg)
+
+
+def range_bounds(ranges):
+    """First and last residue covered by each range.
+
+    As all the segments of a motif fall into a PFAM domain if and only if
+    its span does, this is all :func:`pfam2master` needs. Categorical
+    columns are only parsed once per category. Unparsable ranges get
+    ``-1`` as both bounds.
+
+    :return: Two :class:`numpy.int32` arrays.
+    """
+    if isinstance(getattr(ranges, "dtype", None), pd.CategoricalDtype):
+        ini, end = range_bounds(ranges.cat.categories)
+        codes = np.asarray(ranges.cat.codes)
+        return (np.where(codes < 0, -1, ini[codes]).astype(np.int32),
+                np.where(codes < 0, -1, end[codes]).astype(np.int32))
+    seg = range_segments(ranges)
+    ini = np.full(len(ranges), np.iinfo(np.int32).max, dtype=np.int64)
+    end = np.full(len(ranges), -1, dtype=np.int64)
+    np.minimum.at(ini, seg["row"].values, seg["ini"].values)
+    np.maximum.at(end, seg["row"].values, seg["end"].values)
+    ini[end < 0] = -1
+    return ini.astype(np.int32), end.astype(np.int32)
+
+
 def pfam2master(dfs, pfam):
     """Assign pfam data to master searches data.
     """
-    def fit_in_range(motif_range, pfam_range):
-        """As a single protein can have multiple PFAM domains,
-        this function evaluates if the motif match falls
-        inside the assigned PFAM domain.
-        """
-        if pfam_range == np.nan or isinstance(pfam_range, float):
-            return False
-        pfam_range = [int(x) for x in pfam_range.split("-")]
-        motif_range = (motif_range.replace(")(", "),(")
-                                  .replace("(", "")
-                                  .replace(")", "")
-                                  .strip("[]"))
-        cmatch = 0
-        for r in motif_range.split(","):
-            r = [int(x) for x in r.split("-")]
-            if r[0] >= pfam_range[0] and r[1] <= pfam_range[1]:
-                cmatch += 1
-            else:
-                return False
-        return cmatch == len(motif_range.split(","))
-
     for k in dfs:
-        dfs[k] = dfs[k].merge(pfam, how="left", on=["pdb", "chain"])
-        dfs[k]["inrange"] = dfs[k].apply(
-            lambda row: fit_in_range(row["range"],
-                                     row["pfamrange"]),
-            axis=1)
+        start = time.perf_counter()
+        if (isinstance(pfam["pdb"].dtype, pd.CategoricalDtype) and
+                isinstance(pfam["chain"].dtype, pd.CategoricalDtype)):
+            dfs[k] = _pfam_merge(dfs[k], pfam)
+        else:
+            dfs[k] = dfs[k].merge(pfam, how="left", on=["pdb", "chain"])
+        if "range_ini" in dfs[k]:
+            # Ranges pre-parsed by load_master
+            ini, end = dfs[k]["range_ini"].values, dfs[k]["range_end"].values
+            pini, pend = range_bounds(dfs[k]["pfamrange"])
+            dfs[k]["inrange"] = ((ini >= 0) & (pini >= 0) &
+                                 (ini >= pini) & (end <= pend))
+        else:
+            dfs[k]["inrange"] = fit_in_range(dfs[k]["range"].values,
+                                             dfs[k]["pfamrange"].values)
+        _log.debug("pfam2master %s: %d rows in %.3f s", k, len(dfs[k]),
+                   time.perf_counter() - start)
     return dfs
 
 
+_RECOVERY = {}
+
+
+def _recovery_hits(df, selfname):
+    """Master hits of ``df`` as plain arrays, cached per DataFrame.
+
+    Self-hits and error assignments are removed and every (pdb, chain)
+    is replaced by an integer code. The cache entry is dropped when
+    ``df`` is garbage collected; DataFrames modified in place after
+    being plotted are not detected.
+    """
+    key = (id(df), selfname)
+    if key not in _RECOVERY:
+        sdf = df[(df["pdb"] != "eeee") & (df["pdb"] != selfname)]
+        codes = sdf.groupby(["pdb", "chain"], sort=False,
+                            observed=True).ngroup().values
+
+        def column(name):
+            if name not in sdf:
+                return None
+            return sdf[name].values.astype(float)
+
+        _RECOVERY[key] = {
+            "rmsd": sdf["rmsd"].values.astype(float),
+            "group": codes,
+            "length": column("length"),
+            "inrange": (sdf["inrange"].values.astype(bool)
+                        if "inrange" in sdf else None),
+            "ddg": column("ddg"),
+            "curves": {}}
+        weakref.finalize(df, _RECOVERY.pop, key, None)
+    return _RECOVERY[key]
+
+
+def best_hits(df, selfname, min_length=None, max_length=None, clash=False):
+    """RMSD of the best hit per (pdb, chain).
+
+    :param df: Master hits (with PFAM data if filtering by length).
+    :param str selfname: PDB of the query, whose self-hits are skipped.
+    :param min_length: Only keep hits inside a PFAM domain at least this
+        long.
+    :param max_length: Only keep hits inside a PFAM domain at most this
+        long.
+    :param bool clash: Only keep non-clashing hits (``ddg <= 0``); ignored
+        if there is no clash data.
+    """
+    hits = _recovery_hits(df, selfname)
+    mask = hits["group"] >= 0
+    if min_length is not None or max_length is not None:
+        length = hits["length"]
+        mask &= hits["inrange"]
+        if min_length is not None:
+            mask &= length >= min_length
+        if max_length is not None:
+            mask &= length <= max_length
+    if clash and hits["ddg"] is not None:
+        mask &= hits["ddg"] <= 0
+    best = np.full(hits["group"].max(initial=-1) + 1, np.inf)
+    np.minimum.at(best, hits["group"][mask], hits["rmsd"][mask])
+    return np.sort(best[np.isfinite(best)])
+
+
+def recovery_curve(df, selfname, maxim, rmsd_lim=5, min_length=None,
+                   max_length=None, clash=False):
+    """True cumulative curve of the best hit per (pdb, chain).
+
+    (seaborn does an aproximation that does not work well with very
+    small recovery). Curves are cached per DataFrame and parameters.
+
+    :return: cumulative counts, x (rmsd) and y (recovery) values.
+    """
+    curves = _recovery_hits(df, selfname)["curves"]
+    key = (maxim, rmsd_lim, min_length, max_length, clash)
+    if key not in curves:
+        values = best_hits(df, selfname, min_length, max_length, clash)
+        raw, y, x = rstoolbox.analysis.cumulative(values.reshape(-1, 1),
+                                                  max_count=maxim,
+                                                  upper_limit=rmsd_lim)
+        curves[key] = (raw, x, y)
+    return curves[key]
+
+
+def recovery_curves(df, selfname, maxim, rmsd_lim=5, min_length=50,
+                    max_length=100):
+    """Tidy table with all the recovery curves of a master search.
+
+    Curves are ``all`` hits, hits in PFAM domains of the ``length``
+    window, non-clashing hits (``noclash``) and both (``usable``); the
+    last two only if clash data is available.
+    """
+    filters = [("all", None, None, False),
+               ("length", min_length, max_length, False)]
+    if "ddg" in df:
+        filters.extend([("noclash", None, None, True),
+                        ("usable", min_length, max_length, True)])
+    data = []
+    for name, mn, mx, clash in filters:
+        raw, x, y = recovery_curve(df, selfname, maxim, rmsd_lim, mn, mx,
+                                   clash)
+        data.append(pd.DataFrame({"curve": name, "rmsd": x,
+                                  "recovery": y, "count": raw}))
+    return pd.concat(data, ignore_index=True)
+
+
+def recovery_sweep(dfs, min_lengths, max_lengths, rmsd_cutoffs,
+                   clash=True, maxim=None):
+    """Scaffold recovery over a grid of domain-size windows and RMSDs.
+
+    For each master search in ``dfs`` (as returned by :func:`pfam2master`;
+    keys are the query PDBs), counts the (pdb, chain) whose best hit
+    inside a PFAM domain of length ``[min_length, max_length]`` is at or
+    under each RMSD cutoff. Hits are sorted by domain length once, so each
+    window is a slice found with :func:`numpy.searchsorted`, and for a
+    given ``min_length`` growing windows only add the new rows to the
+    running best hit per (pdb, chain).
+
+    :param dfs: Master searches, as used by :func:`plot_all`.
+    :param min_lengths: Minimum domain sizes.
+    :param max_lengths: Maximum domain sizes.
+    :param rmsd_cutoffs: RMSD thresholds.
+    :param bool clash: Only consider non-clashing hits (``ddg <= 0``);
+        ignored for searches without clash data.
+    :param maxim: If given, return fractions of this total instead of
+        counts.
+
+    :return: :class:`dict` with an array of shape
+        ``(len(min_lengths), len(max_lengths), len(rmsd_cutoffs))``
+        per master search.
+    """
+    min_lengths = np.asarray(min_lengths, dtype=float)
+    max_lengths = np.asarray(max_lengths, dtype=float)
+    rmsd_cutoffs = np.asarray(rmsd_cutoffs, dtype=float)
+    max_order = np.argsort(max_lengths, kind="stable")
+
+    sweep = {}
+    for k in dfs:
+        if not isinstance(dfs[k], pd.DataFrame):
+            continue
+        hits = _recovery_hits(dfs[k], k)
+        mask = (hits["group"] >= 0) & hits["inrange"]
+        mask &= ~np.isnan(hits["length"])
+        if clash and hits["ddg"] is not None:
+            mask &= hits["ddg"] <= 0
+        order = np.argsort(hits["length"][mask], kind="stable")
+        length = hits["length"][mask][order]
+        group = hits["group"][mask][order]
+        rmsd = hits["rmsd"][mask][order]
+        ngroups = hits["group"].max(initial=-1) + 1
+
+        counts = np.zeros((len(min_lengths), len(max_lengths),
+                           len(rmsd_cutoffs)))
+        lows = np.searchsorted(length, min_lengths, side="left")
+        highs = np.searchsorted(length, max_lengths, side="right")
+        for i, lo in enumerate(lows):
+            best = np.full(ngroups, np.inf)
+            start = lo
+            for j in max_order:
+                hi = highs[j]
+                if hi <= lo:
+                    continue
+                np.minimum.at(best, group[start:hi], rmsd[start:hi])
+                start = max(start, hi)
+                counts[i, j] = np.searchsorted(np.sort(best), rmsd_cutoffs,
+                                               side="right")
+        sweep[k] = counts if maxim is None else counts / float(maxim)
+    return sweep
+
+
 def plot_all(fig, dfs, total_master_list, min_domain_size,
              max_domain_size, top_limit, mode):
     """Plot data for all cases.
@@ -144,16 +681,12 @@ def plot(df, selfname, maxim, title, ax, known=None, knames=None, kcolor=None,
     """
     Full plot
     """
-    def data_plot(df, ax, maxim, rmsd_lim, linestyle, color):
-        """Calculate true cumulative curves
-        (seaborn does an aproximation that does not work well with very
-        small recovery)
+    def data_plot(ax, linestyle, color, min_length=None, max_length=None,
+                  clash=False):
+        """Plot the cached cumulative curve (see :func:`recovery_curve`).
         """
-        allvalues = (df.sort_values("rmsd")
-                       .groupby(["pdb", "chain"])
-                       .head(1)[["rmsd"]].values)
-        raw, y, x = rstoolbox.analysis.cumulative(allvalues, max_count=maxim,
-                                                  upper_limit=rmsd_lim)
+        raw, x, y = recovery_curve(df, selfname, maxim, rmsd_lim,
+                                   min_length, max_length, clash)
         ax.plot(x, y, color=sns.color_palette()[color], lw=4,
                 linestyle=linestyle)
         return raw, x, y
@@ -167,20 +700,16 @@ def plot(df, selfname, maxim, title, ax, known=None, knames=None, kcolor=None,
         ax.plot([x[idx]], [0.2], shape, c=sns.color_palette()[color],
                 markersize=12)
 
-    # 1. Filter self-hits and error assignments
-    df = df[(df["pdb"] != "eeee") & (df["pdb"] != selfname)]
+    # 1. Self-hits and error assignments are filtered by recovery_curve
 
     # 2. Make cumulative plot for best-hit/pdb-chain for all dataset
-    raw, x, y = data_plot(df, ax, maxim, rmsd_lim, "solid", 0)
+    raw, x, y = data_plot(ax, "solid", 0)
     if annotate:
         first_marker_plot(raw, x, ax, top, 'o', 0, "solid")
 
     # 3. Make cumulative plot for best-hit/pdb-chain for proteins
     # of size "max_length" or smaller
-    sdf = df[(df["length"] >= min_length) &
-             (df["length"] <= max_length) &
-             (df["inrange"])]
-    raw, x, y = data_plot(sdf, ax, maxim, rmsd_lim, "dashed", 0)
+    raw, x, y = data_plot(ax, "dashed", 0, min_length, max_length)
     if annotate:
         first_marker_plot(raw, x, ax, top, 's', 0, "dashed")
 
@@ -188,18 +717,15 @@ def plot(df, selfname, maxim, title, ax, known=None, knames=None, kcolor=None,
     if "ddg" in df:
         # 4.1. Make cumulative plot for best-hit/pdb-chain for
         # all non-clashing dataset
-        raw, x, y = data_plot(df[(df["ddg"] <= 0)], ax, maxim,
-                              rmsd_lim, "solid", 1)
+        raw, x, y = data_plot(ax, "solid", 1, clash=True)
         ax.fill_between(x, 0, y, color=sns.color_palette()[1], alpha=0.3)
         if annotate:
             first_marker_plot(raw, x, ax, top, 'o', 1, "solid")
 
         # 4.2. Make cumulative plot for best-hit/pdb-chain for all non-clashing
         # dataset for proteins of size "max_length" or smaller
-        sdf = df[(df["length"] >= min_length) &
-                 (df["ddg"] <= 0) & (df["length"] <= max_length) &
-                 (df["inrange"])]
-        raw, x, y = data_plot(sdf, ax, maxim, rmsd_lim, "dashed", 1)
+        raw, x, y = data_plot(ax, "dashed", 1, min_length, max_length,
+                              clash=True)
         if annotate:
             first_marker_plot(raw, x, ax, top, 's', 1, "dashed")
 
@@ -300,16 +826,12 @@ def plot_usable(df, selfname, maxim, title, ax,
     """
     Full plot
     """
-    def data_plot(df, ax, maxim, rmsd_lim, linestyle, color):
-        """Calculate true cumulative curves
-        (seaborn does an aproximation that does not work well with very
-        small recovery)
+    def data_plot(ax, linestyle, color, min_length=None, max_length=None,
+                  clash=False):
+        """Plot the cached cumulative curve (see :func:`recovery_curve`).
         """
-        allvalues = (df.sort_values("rmsd")
-                       .groupby(["pdb", "chain"])
-                       .head(1)[["rmsd"]].values)
-        raw, y, x = rstoolbox.analysis.cumulative(allvalues, max_count=maxim,
-                                                  upper_limit=rmsd_lim)
+        raw, x, y = recovery_curve(df, selfname, maxim, rmsd_lim,
+                                   min_length, max_length, clash)
         ax.plot(x, y, color=sns.color_palette()[color], lw=4,
                 linestyle=linestyle)
         return raw, x, y
@@ -323,15 +845,11 @@ def plot_usable(df, selfname, maxim, title, ax,
         ax.plot([x[idx]], [0.2], shape, c=sns.color_palette()[color],
                 markersize=12)
 
-    # 1. Filter self-hits and error assignments
-    df = df[(df["pdb"] != "eeee") & (df["pdb"] != selfname)]
+    # 1. Self-hits and error assignments are filtered by recovery_curve
 
     # 4.2. Make cumulative plot for best-hit/pdb-chain for all non-clashing
     # dataset for proteins of size "max_length" or smaller
-    sdf = df[(df["length"] >= min_length) &
-             (df["ddg"] <= 0) & (df["length"] <= max_length) &
-             (df["inrange"])]
-    raw, x, y = data_plot(sdf, ax, maxim, rmsd_lim, "solid", 1)
+    raw, x, y = data_plot(ax, "solid", 1, min_length, max_length, clash=True)
     ax.fill_between(x, 0, y, color=sns.color_palette()[1], alpha=0.3)
     first_marker_plot(raw, x, ax, top, 's', 1, "solid")
 
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Batched superposition of MASTER matches onto their query motif.
+
+All matches of a search are stacked into a single ``(matches, atoms, 3)``
+array and superposed onto ``data/<epitope>/motif.pdb`` at once (Kabsch
+algorithm, with one :func:`numpy.linalg.svd` call over all the 3x3
+covariance matrices). Besides the global RMSD, the deviation of each
+segment of a discontinuous motif (e.g. the site 0 loop and helix) is
+reported after the global superposition::
+
+    df = rmsd_table("data/4jhw/motif.pdb",
+                    glob.glob("4jhw/structures/*/*.pdb"))
+
+Matches can also be full structures (e.g. designs), with the motif
+residues picked by chain and ranges (such as MASTER's match ranges).
+
+Parsed structures are kept in memory and, for large (gzipped) files such as
+``data/*/*.pdb.gz``, in a ``<file>.npz`` cache next to the source, so they
+are only parsed once.
+"""
+import gzip
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+BACKBONE = ("N", "CA", "C", "O")
+CACHE_VERSION = 1
+
+_ATOMS = {}  # Absolute path -> (stamp, atoms)
+
+
+def _file_stamp(f):
+    """Size and modification time (ns) identifying a file's state.
+    """
+    st = os.stat(f)
+    return np.array([CACHE_VERSION, st.st_size, st.st_mtime_ns],
+                    dtype=np.int64)
+
+
+def read_atoms(filename):
+    """Atoms of the first model of a PDB file (plain or gzipped).
+
+    Only ``ATOM`` records (and selenomethionines) are read; for atoms with
+    alternate locations, the first one is kept.
+
+    :return: :class:`dict` of arrays: ``name``, ``resname``, ``chain``,
+        ``resnum``, ``icode`` and ``xyz`` (atoms x 3).
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    name, resname, chain, resnum, icode, xyz = [], [], [], [], [], []
+    seen = set()
+    with opener(filename, "rt") as fd:
+        for line in fd:
+            if line.startswith("ENDMDL"):
+                break
+            if not (line.startswith("ATOM  ") or
+                    (line.startswith("HETATM") and line[17:20] == "MSE")):
+                continue
+            key = (line[21], line[22:27], line[12:16])
+            if key in seen:
+                continue
+            seen.add(key)
+            name.append(line[12:16].strip())
+            resname.append(line[17:20])
+            chain.append(line[21])
+            resnum.append(int(line[22:26]))
+            icode.append(line[26])
+            xyz.append((float(line[30:38]), float(line[38:46]),
+                        float(line[46:54])))
+    return {"name": np.array(name, dtype="U4"),
+            "resname": np.array(resname, dtype="U3"),
+            "chain": np.array(chain, dtype="U1"),
+            "resnum": np.array(resnum, dtype=np.int64),
+            "icode": np.array(icode, dtype="U1"),
+            "xyz": np.array(xyz, dtype=np.float64).reshape(-1, 3)}
+
+
+def load_atoms(filename, cache=None):
+    """Atoms of a PDB file (see :func:`read_atoms`), parsed only once.
+
+    Structures are kept in memory for the whole session. With ``cache``
+    they are also stored in a ``<filename>.npz`` file next to the source,
+    which is rebuilt whenever the source changes. By default, only gzipped
+    files are cached on disk, as small PDB files parse faster than the
+    cache loads.
+    """
+    path = os.path.abspath(filename)
+    stamp = _file_stamp(path)
+    if path in _ATOMS and np.array_equal(_ATOMS[path][0], stamp):
+        return _ATOMS[path][1]
+    cache = filename.endswith(".gz") if cache is None else cache
+    cache_file = path + ".npz"
+    atoms = None
+    if cache and os.path.isfile(cache_file):
+        with np.load(cache_file) as data:
+            if np.array_equal(data["stamp"], stamp):
+                atoms = {k: data[k] for k in data.files if k != "stamp"}
+    if atoms is None:
+        atoms = read_atoms(path)
+        if cache:
+            tmp = cache_file + ".tmp.npz"
+            try:
+                np.savez(tmp, stamp=stamp, **atoms)
+                os.replace(tmp, cache_file)
+            except OSError:
+                pass
+    _ATOMS[path] = (stamp, atoms)
+    return atoms
+
+
+def residues(atoms, names=BACKBONE, chain=None, ranges=None):
+    """Coordinates of the selected atoms of each residue.
+
+    :param str chain: Only use the residues of this chain.
+    :param list ranges: ``(ini, end)`` residue indices (0-based and
+        inclusive, as in MASTER's match ranges) to keep, in order.
+
+    :return: Coordinates (residues x names x 3; ``NaN`` for missing atoms)
+        and a :class:`~pandas.DataFrame` with the ``chain``, ``resnum``,
+        ``icode`` and ``resname`` of each residue.
+    """
+    keep = np.ones(len(atoms["name"]), dtype=bool)
+    if chain is not None:
+        keep = atoms["chain"] == chain
+    res_chain, resnum = atoms["chain"][keep], atoms["resnum"][keep]
+    icode = atoms["icode"][keep]
+    new = np.ones(len(resnum), dtype=bool)
+    new[1:] = ((res_chain[1:] != res_chain[:-1]) |
+               (resnum[1:] != resnum[:-1]) | (icode[1:] != icode[:-1]))
+    residue = np.cumsum(new) - 1
+    nres = int(new.sum())
+
+    xyz = np.full((nres, len(names), 3), np.nan)
+    atom_names = atoms["name"][keep]
+    coords = atoms["xyz"][keep]
+    for i, name in enumerate(names):
+        sel = atom_names == name
+        xyz[residue[sel], i] = coords[sel]
+    info = pd.DataFrame({"chain": res_chain[new], "resnum": resnum[new],
+                         "icode": icode[new],
+                         "resname": atoms["resname"][keep][new]},
+                        columns=["chain", "resnum", "icode", "resname"])
+    if ranges is not None:
+        index = np.concatenate([np.arange(ini, end + 1)
+                                for ini, end in ranges])
+        xyz, info = xyz[index], info.iloc[index].reset_index(drop=True)
+    return xyz, info
+
+
+def segments(info):
+    """Segment of each residue: a new one starts at each chain break or
+    gap in the residue numbering.
+
+    :param info: Residue :class:`~pandas.DataFrame` of :func:`residues`.
+    """
+    chain, resnum = info["chain"].values, info["resnum"].values
+    new = np.zeros(len(info), dtype=bool)
+    new[1:] = (chain[1:] != chain[:-1]) | (np.diff(resnum) != 1)
+    return np.cumsum(new)
+
+
+def parse_ranges(ranges):
+    """``(ini, end)`` pairs of a range string (``[(a-b)(c-d)]`` as in
+    ``master_search.csv``, or ``[(a,b), (c,d)]`` as in MASTER's output).
+    """
+    return [(int(a), int(b)) for a, b in
+            re.findall(r"(\d+)\s*[-,]\s*(\d+)", ranges)]
+
+
+def stack(filenames, names=BACKBONE, length=None, chains=None, ranges=None):
+    """Coordinates of the residues of several structures (e.g. MASTER
+    matches) as a single array.
+
+    :param int length: Number of residues of each structure; those of a
+        different length are all ``NaN``. Defaults to the length of the
+        first one.
+    :param list chains: Chain of each structure to use (see
+        :func:`residues`); :data:`None` for all of them.
+    :param list ranges: Residue ranges of each structure to use (see
+        :func:`residues`, or a string for :func:`parse_ranges`);
+        :data:`None` for all the residues.
+
+    :return: Coordinates (structures x residues x names x 3).
+    """
+    chains = [None] * len(filenames) if chains is None else chains
+    ranges = [None] * len(filenames) if ranges is None else ranges
+    if len(chains) != len(filenames) or len(ranges) != len(filenames):
+        raise ValueError("chains and ranges need one entry per structure")
+    coords = []
+    for f, chain, rng in zip(filenames, chains, ranges):
+        if isinstance(rng, str):
+            rng = parse_ranges(rng)
+        coords.append(residues(load_atoms(f), names, chain, rng)[0])
+    if length is None:
+        length = len(coords[0]) if len(coords) > 0 else 0
+    out = np.full((len(coords), length, len(names), 3), np.nan)
+    for i, xyz in enumerate(coords):
+        if len(xyz) == length:
+            out[i] = xyz
+    return out
+
+
+def kabsch(reference, mobile, weights=None):
+    """Optimal superposition of a batch of structures onto a reference.
+
+    :param reference: Coordinates (atoms x 3).
+    :param mobile: Coordinates (structures x atoms x 3). Structures with
+        any ``NaN`` coordinate get ``NaN`` results.
+    :param weights: Weight of each atom (defaults to uniform).
+
+    :return: RMSD (structures), rotations (structures x 3 x 3) and
+        translations (structures x 3), such that
+        ``mobile @ rotation.T + translation`` is superposed onto the
+        reference.
+    """
+    reference = np.asarray(reference, dtype=np.float64).reshape(-1, 3)
+    mobile = np.asarray(mobile, dtype=np.float64)
+    mobile = mobile.reshape(len(mobile), -1, 3)
+    if mobile.shape[1] != len(reference):
+        raise ValueError("reference and structures have different number "
+                         "of atoms: {} != {}".format(len(reference),
+                                                     mobile.shape[1]))
+    w = np.ones(len(reference)) if weights is None \
+        else np.asarray(weights, dtype=np.float64)
+    w = w / w.sum()
+    bad = np.isnan(mobile).any(axis=(1, 2))
+    mobile = np.where(bad[:, None, None], 0.0, mobile)
+
+    ref_center = w @ reference
+    mob_center = np.einsum("m,nmi->ni", w, mobile)
+    x = reference - ref_center
+    y = mobile - mob_center[:, None]
+    h = np.einsum("m,mi,nmj->nij", w, x, y)
+    u, s, vt = np.linalg.svd(h)
+    d = np.sign(np.linalg.det(u) * np.linalg.det(vt))
+    d[d == 0] = 1
+    u[:, :, 2] *= d[:, None]
+    rotation = u @ vt
+
+    msd = (w @ (x * x).sum(axis=1) + np.einsum("m,nmi,nmi->n", w, y, y) -
+           2 * (s[:, 0] + s[:, 1] + d * s[:, 2]))
+    rmsd = np.sqrt(np.maximum(msd, 0))
+    translation = ref_center - np.einsum("nij,nj->ni", rotation, mob_center)
+    rmsd[bad] = np.nan
+    rotation[bad] = np.nan
+    translation[bad] = np.nan
+    return rmsd, rotation, translation
+
+
+def segment_rmsd(reference, mobile, segment, weights=None):
+    """Global RMSD and RMSD of each segment after the global superposition.
+
+    :param reference: Coordinates (residues x names x 3).
+    :param mobile: Coordinates (structures x residues x names x 3).
+    :param segment: Segment of each residue (see :func:`segments`).
+    :param weights: Weight of each segment in the superposition (defaults
+        to the same weight per atom), e.g. to keep a short loop from being
+        dominated by a long helix.
+
+    :return: RMSD (structures) and RMSD per segment (structures x
+        segments).
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    mobile = np.asarray(mobile, dtype=np.float64)
+    nnames = reference.shape[1]
+    _, segment = np.unique(segment, return_inverse=True)
+    atom_segment = np.repeat(segment, nnames)
+    nseg = segment.max() + 1 if len(segment) > 0 else 0
+    w = None
+    if weights is not None:
+        size = np.bincount(atom_segment, minlength=nseg)
+        w = np.asarray(weights, dtype=np.float64)[atom_segment] / \
+            size[atom_segment]
+
+    ref = reference.reshape(-1, 3)
+    mob = mobile.reshape(len(mobile), -1, 3)
+    rmsd, rotation, translation = kabsch(ref, mob, w)
+    fit = np.einsum("nij,nmj->nmi", rotation, mob) + translation[:, None]
+    sq = ((fit - ref) ** 2).sum(axis=2)
+    if weights is not None:
+        # Report the plain RMSD of the weighted superposition.
+        rmsd = np.sqrt(sq.mean(axis=1))
+    per_segment = np.stack([
+        np.sqrt(sq[:, atom_segment == i].mean(axis=1)) for i in range(nseg)],
+        axis=1) if nseg > 0 else np.zeros((len(mob), 0))
+    return rmsd, per_segment
+
+
+def rmsd_table(motif, matches, names=BACKBONE, weights=None, chains=None,
+               ranges=None):
+    """RMSD of MASTER matches to their motif, globally and per segment.
+
+    :param str motif: Motif PDB file (e.g. ``data/4jhw/motif.pdb``);
+        segments are defined by its chain breaks and numbering gaps.
+    :param list matches: Match PDB files, with the motif residues in order
+        (or picked by ``chains`` and ``ranges``).
+    :param weights: Weight of each segment (see :func:`segment_rmsd`).
+    :param list chains: Chain of each match with the motif (see
+        :func:`stack`).
+    :param list ranges: Motif residues of each match (see :func:`stack`),
+        e.g. the ``range`` column of ``master_search.csv``.
+
+    :return: :class:`~pandas.DataFrame` with a ``str`` column (match name,
+        as in ``master_search.csv``), ``rmsd`` and ``rmsd_<i>`` for each
+        segment ``i``.
+    """
+    ref, info = residues(load_atoms(motif), names)
+    mobile = stack(matches, names, len(ref), chains, ranges)
+    rmsd, per_segment = segment_rmsd(ref, mobile, segments(info), weights)
+    df = pd.DataFrame({"str": [os.path.split(f)[-1].replace(".pdb", "")
+                               for f in matches],
+                       "rmsd": rmsd})
+    for i in range(per_segment.shape[1]):
+        df["rmsd_{}".format(i)] = per_segment[:, i]
+    return df
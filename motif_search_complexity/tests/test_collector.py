@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import collector  # noqa: E402
+import parse_master  # noqa: E402
+
+
+def make_tree(root, n, start=0):
+    for i in range(start, n):
+        folder = os.path.join(root, "structures", "{:03d}".format(i // 10))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, "m{:04d}.pdb".format(i)), "w") as fd:
+            fd.write("REMARK {:.3f} /pds/1abc_A.pds [(1,8), (20,36)]\n"
+                     .format(i / 10.))
+
+
+def collect(root, **kwargs):
+    return collector.collect(
+        os.path.join(root, "structures"), parse_master.get_data,
+        parse_master.COLUMNS, parse_master.ERROR,
+        os.path.join(root, "master_search.csv"), processes=2,
+        progress=None, **kwargs)
+
+
+def test_resume_after_truncated_manifest(tmpdir):
+    root = str(tmpdir)
+    make_tree(root, 25)
+    assert collect(root, chunksize=10) == (25, 0, 25)
+
+    # An append cut short in the middle of a row.
+    mfile = collector.manifest_file(os.path.join(root, "master_search.csv"))
+    with open(mfile, "rb+") as fd:
+        fd.truncate(os.path.getsize(mfile) - 20)
+
+    nparsed, nerrors, nrows = collect(root, chunksize=10)
+    assert nparsed == 1 and nerrors == 0 and nrows == 25
+    df = pd.read_csv(os.path.join(root, "master_search.csv"))
+    assert sorted(df["str"]) == ["m{:04d}".format(i) for i in range(25)]
+    assert collect(root) == (0, 0, 25)
+
+
+def test_truncated_header(tmpdir):
+    root = str(tmpdir)
+    make_tree(root, 5)
+    collect(root)
+    mfile = collector.manifest_file(os.path.join(root, "master_search.csv"))
+    with open(mfile, "rb+") as fd:
+        fd.truncate(3)
+    assert collect(root) == (5, 0, 5)
+
+
+def test_resume_after_interrupted_output(tmpdir, monkeypatch):
+    root = str(tmpdir)
+    outfile = os.path.join(root, "master_search.csv")
+    make_tree(root, 24)
+    collect(root)
+    make_tree(root, 25, start=24)
+
+    def interrupted(src, dst):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as m:
+        m.setattr(collector.os, "replace", interrupted)
+        try:
+            collect(root)
+        except KeyboardInterrupt:
+            pass
+    assert len(pd.read_csv(outfile)) == 24
+
+    assert collect(root) == (0, 0, 25)
+    assert len(pd.read_csv(outfile)) == 25
+    assert collect(root) == (0, 0, 25)
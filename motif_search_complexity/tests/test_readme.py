@@ -0,0 +1,123 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+for module in ["matplotlib", "seaborn", "rstoolbox"]:
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import readme  # noqa: E402
+
+
+def frame(**columns):
+    return pd.DataFrame({k: pd.Series(v, dtype="category")
+                         for k, v in columns.items()})
+
+
+def test_category_keys_unknown_values_without_warnings():
+    reference = frame(pdb=["1abc", "2xyz", "1abc"], chain=["A", "A", "B"])
+    df = frame(pdb=["2xyz", "9zzz", "1abc"], chain=["A", "A", "C"])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        keys = readme._category_keys(df, reference, ["pdb", "chain"])
+    assert keys[1] == -1 and keys[2] == -1
+    assert keys[0] == readme._category_keys(reference, reference,
+                                            ["pdb", "chain"])[1]
+
+
+def test_pfam_merge_without_warnings():
+    pfam = frame(pdb=["1abc", "2xyz"], chain=["A", "A"],
+                 pfamrange=["1-50", "10-90"], pfam=["PF1", "PF2"])
+    df = frame(pdb=["2xyz", "9zzz"], chain=["A", "A"])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        merged = readme._pfam_merge(df, pfam)
+    assert list(merged["pfam"].astype(object).fillna("")) == ["PF2", ""]
+    expected = df.merge(pfam, how="left", on=["pdb", "chain"])
+    assert np.array_equal(merged["pfamrange"].astype(object).fillna(""),
+                          expected["pfamrange"].astype(object).fillna(""))
+
+
+def write_master(folder):
+    os.makedirs(os.path.join(folder, "data", "test"))
+    master = pd.DataFrame({
+        "str": ["m1", "m2", "m3", "m4"], "cluster": ["c1", "c1", "c2", "c2"],
+        "rmsd": [0.5, 1.0, 1.5, 2.0], "pdb": ["1abc", "1abc", "2xyz", "3def"],
+        "chain": ["A", "B", "A", "A"],
+        "range": ["[(1-8)(20-36)]", "[(3-10)(40-56)]", "[(5-12)(30-46)]",
+                  "none"]})
+    master.to_csv(os.path.join(folder, "data", "test",
+                               "master_search.csv.gz"), index=False)
+    ddg = pd.DataFrame({"cluster": ["c2", "c1"], "ddg": [-1.0, 3.0],
+                        "str": ["m3", "m1"]})
+    ddg.to_csv(os.path.join(folder, "data", "test", "ddg_match.csv.gz"),
+               index=False)
+    return master.merge(ddg, how="left", on=["cluster", "str"])
+
+
+def test_load_master_keeps_names_as_strings(tmpdir, monkeypatch):
+    expected = write_master(str(tmpdir))
+    monkeypatch.chdir(str(tmpdir))
+    fresh = readme.load_master({"test": 1})["test"]
+    cached = readme.load_master({"test": 1})["test"]
+    cache = os.path.join("data", "test", "master_search.cache")
+    assert os.path.isfile(os.path.join(cache, "str.text.npy"))
+    assert not os.path.isfile(os.path.join(cache, "str.categories.npy"))
+    for df in [fresh, cached]:
+        assert not isinstance(df["str"].dtype, pd.CategoricalDtype)
+        assert isinstance(df["pdb"].dtype, pd.CategoricalDtype)
+        assert list(df["str"]) == list(expected["str"])
+        assert list(df["range"]) == list(expected["range"])
+        assert np.allclose(df["ddg"], expected["ddg"], equal_nan=True)
+        assert list(df["range_ini"]) == [1, 3, 5, -1]
+
+
+def hits_frame(n=300, seed=0, ddg=True):
+    """Master hits with PFAM data, as returned by pfam2master."""
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        "pdb": rng.choice(["1abc", "2xyz", "3def", "4jhw", "eeee"], n),
+        "chain": rng.choice(["A", "B", "C"], n),
+        "rmsd": np.round(rng.uniform(0, 5, n), 2),
+        "length": rng.choice([np.nan, 40, 55, 70, 85, 100, 130], n),
+        "inrange": rng.uniform(size=n) < 0.7})
+    if ddg:
+        df["ddg"] = np.round(rng.normal(0, 10, n), 1)
+    return df
+
+
+def test_recovery_without_clash_data():
+    dfs = {"4jhw": hits_frame(ddg=False)}
+    sweep = readme.recovery_sweep(dfs, [50], [100], [1, 5], clash=True)
+    unfiltered = readme.recovery_sweep(dfs, [50], [100], [1, 5], clash=False)
+    assert np.array_equal(sweep["4jhw"], unfiltered["4jhw"])
+    assert np.array_equal(
+        readme.best_hits(dfs["4jhw"], "4jhw", clash=True),
+        readme.best_hits(dfs["4jhw"], "4jhw"))
+
+
+def test_recovery_sweep_matches_single_curves():
+    dfs = {"4jhw": hits_frame(seed=1), "5tpn": hits_frame(seed=2),
+           "pfam": None}
+    min_lengths, max_lengths = [30, 50, 70], [120, 60, 100, 80]
+    cutoffs = [0.5, 1, 2.5, 5]
+    for clash in [False, True]:
+        sweep = readme.recovery_sweep(dfs, min_lengths, max_lengths,
+                                      cutoffs, clash=clash)
+        assert sorted(sweep) == ["4jhw", "5tpn"]
+        for k in sweep:
+            assert sweep[k].shape == (3, 4, 4)
+            for i, mn in enumerate(min_lengths):
+                for j, mx in enumerate(max_lengths):
+                    best = readme.best_hits(dfs[k], k, mn, mx, clash)
+                    expected = [np.count_nonzero(best <= c) for c in cutoffs]
+                    assert sweep[k][i, j].tolist() == expected
+    fractions = readme.recovery_sweep(dfs, min_lengths, max_lengths, cutoffs,
+                                      maxim=40)
+    counts = readme.recovery_sweep(dfs, min_lengths, max_lengths, cutoffs)
+    assert np.allclose(fractions["4jhw"] * 40, counts["4jhw"])
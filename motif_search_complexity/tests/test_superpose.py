@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import superpose  # noqa: E402
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "data", "4jhw")
+
+
+def rotation(seed):
+    q = np.random.default_rng(seed).normal(size=4)
+    a, b, c, d = q / np.linalg.norm(q)
+    return np.array([
+        [a * a + b * b - c * c - d * d, 2 * (b * c - a * d),
+         2 * (b * d + a * c)],
+        [2 * (b * c + a * d), a * a - b * b + c * c - d * d,
+         2 * (c * d - a * b)],
+        [2 * (b * d - a * c), 2 * (c * d + a * b),
+         a * a - b * b - c * c + d * d]])
+
+
+def write_moved(source, target, seed):
+    """Copy the ATOM records of a PDB file, rotated and translated.
+    """
+    atoms = superpose.read_atoms(source)
+    xyz = atoms["xyz"] @ rotation(seed).T + [10., -5., 3.]
+    with open(target, "w") as fd:
+        for i in range(len(xyz)):
+            fd.write("ATOM  {:>5d} {:<4s} {:3s} {:1s}{:>4d}{:1s}   "
+                     "{:8.3f}{:8.3f}{:8.3f}  1.00  0.00\n".format(
+                         i + 1, atoms["name"][i], atoms["resname"][i],
+                         atoms["chain"][i], atoms["resnum"][i],
+                         atoms["icode"][i], *xyz[i]))
+
+
+def test_motif_inside_full_structure(tmpdir):
+    motif = os.path.join(DATA, "motif.pdb")
+    full = str(tmpdir.join("design.pdb"))
+    write_moved(os.path.join(DATA, "4jhw.pdb.gz"), full, 0)
+
+    # Motif residues (62-69 and 196-212) as indices within chain F.
+    _, info = superpose.residues(superpose.read_atoms(full), chain="F")
+    index = np.flatnonzero(info["resnum"].isin(
+        list(range(62, 70)) + list(range(196, 213))).values)
+    ranges = [(index[0], index[7]), (index[8], index[-1])]
+    text = "[({}-{})({}-{})]".format(*[i for r in ranges for i in r])
+    assert superpose.parse_ranges(text) == ranges
+
+    df = superpose.rmsd_table(motif, [full, full], chains=["F", "F"],
+                              ranges=[ranges, text])
+    assert list(df.columns) == ["str", "rmsd", "rmsd_0", "rmsd_1"]
+    assert np.all(df[["rmsd", "rmsd_0", "rmsd_1"]].values < 1e-2)
+
+    # Without the selection, the whole structure cannot be compared.
+    assert np.isnan(superpose.rmsd_table(motif, [full])["rmsd"][0])
+
+
+def test_batch_matches_single_superpositions():
+    ref, info = superpose.residues(
+        superpose.load_atoms(os.path.join(DATA, "motif.pdb")))
+    rng = np.random.default_rng(1)
+    mobile = np.stack([(ref + rng.normal(scale=0.5, size=ref.shape)) @
+                       rotation(i).T for i in range(20)])
+    rmsd, per_segment = superpose.segment_rmsd(ref, mobile,
+                                               superpose.segments(info))
+    for i in range(len(mobile)):
+        single, _ = superpose.segment_rmsd(ref, mobile[i:i + 1],
+                                           superpose.segments(info))
+        assert np.isclose(rmsd[i], single[0])
+    assert per_segment.shape == (20, 2)